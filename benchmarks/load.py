@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import random
+import resource
+import statistics
+import sys
+import time
+
+import aiohttp
+
+import server.config as config
+import server.main as main
+
+from synthetic import generate
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _routes(export_days: int) -> list[tuple[str, int]]:
+    """Get the requested paths and their weights"""
+    start = int(time.time()) - export_days * 86400
+    routes = [
+        ("/", 2),
+        ("/datetime", 10),
+        ("/linky/image", 5),
+        ("/pressure/image", 5),
+        ("/onoff/json", 5),
+        ("/linky/csv?start={start}", 1),
+        ("/onoff/csv?start={start}", 1),
+        ("/pressure/csv?start={start}", 1),
+    ]
+    for name in config.humidity_temperatures:
+        routes.append((f"/temperature_humidity/image/{name}", 3))
+        routes.append((f"/temperature_humidity/csv?name={name}&start={{start}}", 1))
+    return [(path.format(start=start), weight) for path, weight in routes]
+
+
+def _route_name(path: str) -> str:
+    return path.partition("?")[0]
+
+
+async def _drive_async(
+    base_url: str, routes: list[tuple[str, int]], concurrency: int,
+    duration: float, seed: int
+) -> dict:
+    rnd = random.Random(seed)
+    paths = [path for path, _ in routes]
+    weights = [weight for _, weight in routes]
+    latencies = {}
+    errors = {}
+    deadline = time.monotonic() + duration
+
+    async def client(session: aiohttp.ClientSession):
+        while time.monotonic() < deadline:
+            path = rnd.choices(paths, weights)[0]
+            name = _route_name(path)
+            start = time.perf_counter()
+            try:
+                async with session.get(base_url + path) as response:
+                    await response.read()
+                    ok = response.status < 400
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                latencies.setdefault(name, []).append(time.perf_counter() - start)
+            else:
+                errors[name] = errors.get(name, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+
+    return {"latencies": latencies, "errors": errors, "pid": os.getpid()}
+
+
+def _drive(*args) -> dict:
+    # run in a separate process so that the clients do not share the event
+    # loop of the server
+    return asyncio.run(_drive_async(*args))
+
+
+def _rss(pid: str = "self") -> int:
+    """Get the resident set size of a process in KiB"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid != "self":
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _descendants(pid: int) -> list[int]:
+    """Get the processes started by a process, directly or not (Linux only)"""
+    children = {}
+    for path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = path.read_text()
+        except OSError:
+            continue
+        # the command name, in parentheses, may contain spaces
+        ppid = int(stat.rpartition(")")[2].split()[1])
+        children.setdefault(ppid, []).append(int(path.parent.name))
+
+    descendants = []
+    pending = [pid]
+    while pending:
+        pids = children.get(pending.pop(), [])
+        descendants.extend(pids)
+        pending.extend(pids)
+    return descendants
+
+
+def _workers_rss(excluded: set[int]) -> int:
+    """Get the resident set size of the processes started by the server, the
+    render workers among them, in KiB"""
+    return sum(
+        _rss(str(pid)) for pid in _descendants(os.getpid()) if pid not in excluded
+    )
+
+
+async def _monitor_lag(samples: list[float], interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+def _percentiles(values: list[float]) -> dict:
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return {"p50": value, "p95": value, "p99": value, "max": value}
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        "p50": quantiles[49],
+        "p95": quantiles[94],
+        "p99": quantiles[98],
+        "max": max(values),
+    }
+
+
+async def _run_level(
+    executor: ProcessPoolExecutor, base_url: str, routes: list,
+    concurrency: int, duration: float, seed: int, clients: set[int]
+) -> dict:
+    """Run the clients at a concurrency level, clients holding the process
+    ids of the clients, which are not counted in the RSS of the workers"""
+    lags = []
+    monitor = asyncio.create_task(_monitor_lag(lags))
+    rss_start = _rss()
+    workers_rss_start = _workers_rss(clients)
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(
+            executor, _drive, base_url, routes, concurrency, duration, seed
+        )
+    finally:
+        monitor.cancel()
+    clients.add(result["pid"])
+
+    requests = sum(len(v) for v in result["latencies"].values())
+    return {
+        "concurrency": concurrency,
+        "duration": duration,
+        "throughput": requests / duration,
+        "errors": result["errors"],
+        "routes": {
+            name: {"count": len(values), **_percentiles(values)}
+            for name, values in sorted(result["latencies"].items())
+        },
+        "loop_lag": _percentiles(lags),
+        "rss_start_kib": rss_start,
+        "rss_end_kib": _rss(),
+        "workers_rss_start_kib": workers_rss_start,
+        "workers_rss_end_kib": _workers_rss(clients),
+    }
+
+
+def _print_level(level: dict):
+    print(
+        f"concurrency {level['concurrency']}: "
+        f"{level['throughput']:.1f} req/s, "
+        f"loop lag p99 {level['loop_lag']['p99'] * 1000:.1f} ms "
+        f"max {level['loop_lag']['max'] * 1000:.1f} ms, "
+        f"RSS {level['rss_start_kib'] // 1024} -> {level['rss_end_kib'] // 1024} MiB, "
+        f"workers {level['workers_rss_start_kib'] // 1024} -> "
+        f"{level['workers_rss_end_kib'] // 1024} MiB"
+    )
+    for name, stats in level["routes"].items():
+        print(
+            f"    {name:45} {stats['count']:6} "
+            f"p50 {stats['p50'] * 1000:8.1f} ms "
+            f"p95 {stats['p95'] * 1000:8.1f} ms "
+            f"p99 {stats['p99'] * 1000:8.1f} ms"
+        )
+    for name, count in level["errors"].items():
+        print(f"    {name:45} {count:6} errors")
+
+
+async def run(args) -> dict:
+    if not Path(args.database).exists():
+        await generate(args.database, args.days, args.seed)
+    config.database.path = args.database
+    config.server.port = args.port
+    if args.no_cache:
+        config.cache.max_bytes = 0
+
+    await main.init()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    routes = _routes(args.export_days)
+    report = {"levels": [], "soak": []}
+    executor = ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    )
+    clients = set()
+    try:
+        for concurrency in args.concurrency:
+            level = await _run_level(
+                executor, base_url, routes, concurrency, args.duration, args.seed,
+                clients
+            )
+            _print_level(level)
+            report["levels"].append(level)
+
+        # the soak runs at the highest concurrency, by periods of duration
+        # seconds, to follow the RSS growth
+        soak_end = time.monotonic() + args.soak
+        while time.monotonic() < soak_end:
+            level = await _run_level(
+                executor, base_url, routes, max(args.concurrency),
+                args.duration, args.seed + len(report["soak"]) + 1, clients
+            )
+            _print_level(level)
+            report["soak"].append(level)
+    finally:
+        executor.shutdown()
+        await main.close()
+
+    return report
+
+
+if __name__ == "__main__":
+    handler = logging.StreamHandler(stream=sys.stdout)
+    formatter = logging.Formatter("%(asctime)s %(module)s %(levelname)s %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="load and soak the server")
+    parser.add_argument("-c", "--config", default="config.toml")
+    parser.add_argument("--database",
+                        default=str(Path(__file__).with_name("bench.db")),
+                        help="synthetic database, generated if missing")
+    parser.add_argument("--days", type=int, default=365,
+                        help="days of data of the generated database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--concurrency", default="1,4,16,64",
+                        type=lambda s: [int(c) for c in s.split(",")],
+                        help="comma separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30.0,
+                        help="seconds per concurrency level")
+    parser.add_argument("--soak", type=float, default=0.0,
+                        help="seconds of soak at the highest concurrency")
+    parser.add_argument("--export-days", type=int, default=7,
+                        help="window of the CSV exports in days")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="disable the rendered images cache")
+    parser.add_argument("-o", "--output",
+                        default=str(Path(__file__).with_name("load-results.json")))
+    args = parser.parse_args()
+
+    config.read(args.config)
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+from datetime import datetime
+from datetime import timedelta
+import json
+import logging
+from pathlib import Path
+import platform
+import statistics
+import sys
+import time
+
+from aiohttp.test_utils import TestClient
+from aiohttp.test_utils import TestServer
+
+import server.admission as admission
+import server.config as config
+import server.db as db
+import server.graph as graph
+from server.serverm import make_app
+
+from synthetic import generate
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+async def _measure(func, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - start)
+    return {
+        "median": statistics.median(durations),
+        "min": min(durations),
+        "runs": repeat,
+    }
+
+
+async def _consume(generator):
+    async for _ in generator:
+        pass
+
+
+async def _download(client: TestClient, path: str):
+    async with client.get(path, headers={"Accept-Encoding": "identity"}) as response:
+        response.raise_for_status()
+        await response.read()
+
+
+def _benchmarks(windows: list[int], client: TestClient) -> dict:
+    """Get the benchmarked coroutine functions by name"""
+    pressure = config.atmospheric_pressure
+    th_name, th = next(iter(config.humidity_temperatures.items()))
+    event = config.events[0].name if config.events else None
+
+    benchmarks = {}
+    for days in windows:
+        end = datetime.now()
+        start = end - timedelta(days=days)
+        ts = int(start.timestamp())
+
+        benchmarks.update({
+            f"db.get_all_linky_records[{days}d]":
+                lambda start=start, end=end: db.get_all_linky_records(start, end),
+            f"db.get_all_pressure_records[{days}d]":
+                lambda start=start, end=end: db.get_all_pressure_records(start, end),
+            f"db.get_all_temperature_humidity_records[{days}d]":
+                lambda start=start, end=end: db.get_all_temperature_humidity_records(
+                    th_name, start, end
+                ),
+            f"db.get_many_rows[{days}d]":
+                lambda start=start, end=end: _consume(db.get_linky_records(
+                    start, end, records_number=config.export.batch_size
+                )),
+            f"graph.plot_linky[{days}d]":
+                lambda days=days: graph.plot_linky(days),
+            f"graph.plot_pressure[{days}d]":
+                lambda days=days: graph.plot_pressure(pressure.min, pressure.max, days),
+            f"graph.plot_temperature_humidity[{days}d]":
+                lambda days=days: graph.plot_temperature_humidity(
+                    th_name, th.humidity_min, th.humidity_max,
+                    th.temperature_min, th.temperature_max, days
+                ),
+            f"GET /linky/csv[{days}d]":
+                lambda ts=ts: _download(client, f"/linky/csv?start={ts}"),
+            f"GET /onoff/csv[{days}d]":
+                lambda ts=ts: _download(client, f"/onoff/csv?start={ts}"),
+            f"GET /pressure/csv[{days}d]":
+                lambda ts=ts: _download(client, f"/pressure/csv?start={ts}"),
+            f"GET /temperature_humidity/csv[{days}d]":
+                lambda ts=ts: _download(
+                    client, f"/temperature_humidity/csv?name={th_name}&start={ts}"
+                ),
+        })
+        if event is not None:
+            benchmarks[f"db.get_all_on_off_records[{days}d]"] = (
+                lambda start=start, end=end: db.get_all_on_off_records(event, start, end)
+            )
+    return benchmarks
+
+
+async def run(
+    database: str, days: int, windows: list[int], repeat: int, seed: int,
+    selection: str
+) -> dict:
+    if not Path(database).exists():
+        await generate(database, days, seed)
+    config.database.path = database
+
+    admission.init()
+    graph.init()
+    await db.init()
+    client = TestClient(TestServer(make_app()))
+    await client.start_server()
+
+    results = {}
+    try:
+        benchmarks = _benchmarks([w for w in windows if w <= days], client)
+        # warm up the render workers and the page cache
+        for name, func in benchmarks.items():
+            if selection in name:
+                await func()
+        for name, func in benchmarks.items():
+            if selection not in name:
+                continue
+            results[name] = await _measure(func, repeat)
+            logger.info(f"{name}: {results[name]['median'] * 1000:.1f} ms")
+    finally:
+        await client.close()
+        await db.close()
+        await graph.close()
+        await admission.close()
+
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "database": database,
+            "days": days,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Get the benchmarks whose median is threshold times slower than in the
+    baseline"""
+    regressions = []
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        ratio = result["median"] / reference["median"]
+        line = (
+            f"{name}: {reference['median'] * 1000:.1f} ms -> "
+            f"{result['median'] * 1000:.1f} ms (x{ratio:.2f})"
+        )
+        print(line)
+        if ratio > threshold:
+            regressions.append(line)
+    return regressions
+
+
+def main():
+    handler = logging.StreamHandler(stream=sys.stdout)
+    formatter = logging.Formatter("%(asctime)s %(module)s %(levelname)s %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="time the db and graph hot paths")
+    parser.add_argument("-c", "--config", default="config.toml")
+    parser.add_argument("--database",
+                        default=str(Path(__file__).with_name("bench.db")),
+                        help="synthetic database, generated if missing")
+    parser.add_argument("--days", type=int, default=365,
+                        help="days of data of the generated database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--windows", default="1,7,30,365",
+                        help="comma separated windows in days")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("-k", "--select", default="",
+                        help="only run the benchmarks whose name contains this")
+    parser.add_argument("-o", "--output",
+                        default=str(Path(__file__).with_name("bench-results.json")))
+    parser.add_argument("--baseline", help="results to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    config.read(args.config)
+    windows = [int(w) for w in args.windows.split(",")]
+    results = asyncio.run(
+        run(args.database, args.days, windows, args.repeat, args.seed, args.select)
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if len(regressions) != 0:
+            print(f"{len(regressions)} regression(s):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
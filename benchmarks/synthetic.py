@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+from datetime import datetime
+import logging
+import math
+from pathlib import Path
+import random
+import sqlite3
+import time
+
+import server.config as config
+import server.db as db
+import server.schema as schema
+
+# seconds between two readings
+LINKY_PERIOD = 60
+PRESSURE_PERIOD = 60
+TEMPERATURE_HUMIDITY_PERIOD = 120
+# average number of events per day and per event device
+EVENTS_PER_DAY = 6
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _linky_rows(rnd: random.Random, start: int, end: int):
+    east = 0
+    for timestamp in range(start, end, LINKY_PERIOD):
+        hour = (timestamp % 86400) / 3600
+        # higher consumption in the morning and in the evening
+        base = 400 + 1200 * max(0.0, math.sin((hour - 6) * math.pi / 16))
+        sinst = int(base + rnd.gauss(0, 150)) if rnd.random() > 0.02 else rnd.randint(3000, 6000)
+        sinst = max(sinst, 50)
+        east += sinst * LINKY_PERIOD // 3600
+        yield east, sinst, timestamp
+
+
+def _pressure_rows(rnd: random.Random, start: int, end: int):
+    pressure = 1013.25
+    for timestamp in range(start, end, PRESSURE_PERIOD):
+        # slow random walk bounded around the standard pressure
+        pressure += rnd.gauss(0, 0.05) - (pressure - 1013.25) * 0.0005
+        yield round(pressure - 38.0, 2), timestamp
+
+
+def _temperature_humidity_rows(
+    rnd: random.Random, device: str, start: int, end: int
+):
+    outdoor = device == "outdoor"
+    for timestamp in range(start, end, TEMPERATURE_HUMIDITY_PERIOD):
+        day = (timestamp % 86400) / 86400
+        year = (timestamp % 31557600) / 31557600
+        seasonal = -8.0 * math.cos(2 * math.pi * (year - 0.05))
+        daily = -4.0 * math.cos(2 * math.pi * (day - 0.1))
+        if outdoor:
+            temperature = 12.0 + seasonal + daily + rnd.gauss(0, 0.3)
+        else:
+            temperature = 20.0 + seasonal / 8 + daily / 4 + rnd.gauss(0, 0.1)
+        humidity = min(100.0, max(0.0, 60.0 - (temperature - 15.0) * 1.5 + rnd.gauss(0, 1.0)))
+        yield device, round(humidity, 1), round(temperature, 2), timestamp
+
+
+def _on_off_rows(rnd: random.Random, device: str, start: int, end: int):
+    timestamp = start
+    while True:
+        timestamp += int(rnd.expovariate(EVENTS_PER_DAY / 86400)) + 1
+        if timestamp >= end:
+            break
+        yield device, 1, timestamp
+
+
+async def generate(path: str, days: int, seed: int = 0, end: int = None) -> int:
+    """Write days of readings ending at end (default: now) in a new database
+
+    The devices are the ones of the configuration, which must have been
+    read. Returns the number of rows written.
+    """
+    if end is None:
+        end = int(time.time())
+    start = end - days * 86400
+
+    Path(path).unlink(missing_ok=True)
+    config.database.path = path
+    # let the server create its tables and indexes
+    await db.init()
+    await schema.migrate()
+    await db.close()
+
+    rnd = random.Random(seed)
+    tables = [
+        ("INSERT INTO linky(east, sinst, timestamp) VALUES (?, ?, ?);",
+         _linky_rows(rnd, start, end)),
+        ("INSERT INTO pressure(pressure, timestamp) VALUES (?, ?);",
+         _pressure_rows(rnd, start, end)),
+    ]
+    for device in config.humidity_temperatures:
+        tables.append((
+            "INSERT INTO temperature_humidity(device, humidity, temperature, timestamp) "
+            "VALUES (?, ?, ?, ?);",
+            _temperature_humidity_rows(rnd, device, start, end)
+        ))
+    for device in config.events:
+        tables.append((
+            "INSERT INTO on_off(device, state, timestamp) VALUES (?, ?, ?);",
+            _on_off_rows(rnd, device.name, start, end)
+        ))
+
+    rows_number = 0
+    conn = sqlite3.connect(path)
+    try:
+        for query, rows in tables:
+            cur = conn.executemany(query, rows)
+            rows_number += cur.rowcount
+        conn.commit()
+        conn.execute("ANALYZE;")
+    finally:
+        conn.close()
+
+    logger.info(
+        f"{rows_number} rows written in {path} "
+        f"({datetime.fromtimestamp(start)} - {datetime.fromtimestamp(end)})"
+    )
+    return rows_number
+
+
+if __name__ == "__main__":
+    import sys
+
+    handler = logging.StreamHandler(stream=sys.stdout)
+    formatter = logging.Formatter("%(asctime)s %(module)s %(levelname)s %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    parser = argparse.ArgumentParser(description="generate a synthetic database")
+    parser.add_argument("-c", "--config", default="config.toml")
+    parser.add_argument("-d", "--days", type=int, default=90)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    config.read(args.config)
+    asyncio.run(generate(args.path, args.days, args.seed))
@@ -0,0 +1,132 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import logging
+import time
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+
+import server.config as config
+import server.metrics as metrics
+from server.typem import OverloadedError
+
+# kinds of work, limited separately
+KINDS = ("render", "export", "json")
+
+_limiters = {}
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_running = metrics.Gauge(
+    "admission_running", "jobs holding a slot", ("kind",)
+)
+_waiting = metrics.Gauge(
+    "admission_queue_depth", "jobs waiting for a slot", ("kind",)
+)
+_wait_time = metrics.Histogram(
+    "admission_wait_seconds", "time spent waiting for a slot", ("kind",)
+)
+_refused = metrics.Counter(
+    "admission_refused_total", "jobs refused because the queue was full",
+    ("kind",)
+)
+
+
+class Limiter:
+    """Run at most concurrency jobs at once, queue at most queue_size jobs
+    and refuse the others"""
+
+    def __init__(self, kind: str, concurrency: int, queue_size: int):
+        self.kind = kind
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.running = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._update_metrics()
+
+    def _update_metrics(self):
+        _running.set(self.running, self.kind)
+        _waiting.set(len(self._waiters), self.kind)
+
+    async def acquire(self):
+        """Wait for a slot, raises OverloadedError if the queue is full"""
+        if self.running < self.concurrency and not self._waiters:
+            self.running += 1
+            self._update_metrics()
+            _wait_time.observe(0.0, self.kind)
+            return
+        if len(self._waiters) >= self.queue_size:
+            _refused.inc(self.kind)
+            raise OverloadedError(f"too many {self.kind} requests")
+
+        start = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._update_metrics()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                # release() skips the cancelled waiters it meets first
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._update_metrics()
+            else:
+                # the slot was handed over just before the cancellation
+                self.release()
+            raise
+        _wait_time.observe(time.perf_counter() - start, self.kind)
+
+    def release(self):
+        # the slot goes to the first waiter, the number of running jobs is
+        # unchanged
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_metrics()
+                return
+        self.running -= 1
+        self._update_metrics()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def init():
+    for kind in KINDS:
+        _limiters[kind] = Limiter(
+            kind,
+            getattr(config.admission, f"{kind}_concurrency"),
+            getattr(config.admission, f"{kind}_queue")
+        )
+        logger.debug(f"{kind} limiter: {_limiters[kind].concurrency} slots")
+
+
+def slot(kind: str):
+    """Context manager holding a slot of kind while the job runs
+
+    Raises OverloadedError if the queue of kind is full.
+    """
+    return _limiters[kind].slot()
+
+
+async def admitted(kind: str, produce: Callable[[], Awaitable]):
+    """Await produce() in a slot of kind
+
+    Passed to the singleflights, so that only the production takes a slot.
+    """
+    async with slot(kind):
+        return await produce()
+
+
+async def close():
+    _limiters.clear()
@@ -0,0 +1,250 @@
+from collections import OrderedDict
+from functools import partial
+import hashlib
+import logging
+from pathlib import Path
+import time
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+import aiosqlite
+from sqlite3 import Error as Sqlite3Error
+
+import server.config as config
+import server.metrics as metrics
+import server.singleflight as singleflight
+from server.typem import CacheEntry
+
+_store = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class MemoryStore:
+    """Entries kept in the memory of the process"""
+
+    def __init__(self):
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self.size = 0
+
+    async def open(self):
+        pass
+
+    async def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def put(self, key: Hashable, entry: CacheEntry):
+        await self.remove(key)
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > config.cache.max_bytes:
+            oldest = next(iter(self._entries))
+            await self.remove(oldest)
+            logger.debug(f"{oldest} evicted from the cache")
+
+    async def remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+    async def close(self):
+        self._entries.clear()
+        self.size = 0
+
+
+class SqliteStore:
+    """Entries shared by the processes of the server through a SQLite file
+
+    A body is published atomically by its transaction: the other processes
+    see the previous entry or the new one, never a part of it.
+    """
+
+    _create_query = (
+        "CREATE TABLE IF NOT EXISTS entries ("
+        "key TEXT PRIMARY KEY, watermark INTEGER, etag TEXT NOT NULL, "
+        "body BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL"
+        ");"
+    )
+    _create_index_query = "CREATE INDEX IF NOT EXISTS entries_used_idx ON entries(used);"
+    _get_query = "SELECT watermark, etag, body, used FROM entries WHERE key=?;"
+    _touch_query = "UPDATE entries SET used=? WHERE key=?;"
+    _put_query = (
+        "INSERT OR REPLACE INTO entries(key, watermark, etag, body, size, used) "
+        "VALUES (?, ?, ?, ?, ?, ?);"
+    )
+    _remove_query = "DELETE FROM entries WHERE key=?;"
+    _size_query = "SELECT COALESCE(SUM(size), 0) FROM entries;"
+    _oldest_query = "SELECT key, size FROM entries ORDER BY used;"
+    _touch_delay = 60.0
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._conn = None
+        self.size = 0
+
+    async def open(self):
+        self._conn = await aiosqlite.connect(self._path, autocommit=True)
+        # the entries can be rebuilt: a crash may lose the last ones
+        await self._conn.execute("PRAGMA journal_mode=WAL;")
+        await self._conn.execute("PRAGMA synchronous=NORMAL;")
+        # the other processes may be writing
+        await self._conn.execute("PRAGMA busy_timeout=5000;")
+        await self._conn.execute(self._create_query)
+        await self._conn.execute(self._create_index_query)
+        self.size = await self._fetch_size()
+
+    async def _fetch_size(self) -> int:
+        cur = await self._conn.execute(self._size_query)
+        try:
+            return (await cur.fetchone())[0]
+        finally:
+            await cur.close()
+
+    async def get(self, key: Hashable) -> Optional[CacheEntry]:
+        cur = await self._conn.execute(self._get_query, (repr(key),))
+        try:
+            row = await cur.fetchone()
+        finally:
+            await cur.close()
+        if row is None:
+            return None
+        # the use time is only written when it is old: most hits do not
+        # need to lock the file for writing
+        now = time.time()
+        if row[3] < now - self._touch_delay:
+            await self._conn.execute(self._touch_query, (now, repr(key)))
+        return CacheEntry(*row[:3])
+
+    async def put(self, key: Hashable, entry: CacheEntry):
+        await self._conn.execute(
+            self._put_query,
+            (
+                repr(key), entry.watermark, entry.etag, entry.body,
+                len(entry.body), time.time()
+            )
+        )
+        # the other processes add entries too
+        self.size = await self._fetch_size()
+        if self.size > config.cache.max_bytes:
+            await self._evict()
+
+    async def _evict(self):
+        cur = await self._conn.execute(self._oldest_query)
+        try:
+            keys = []
+            async for key, size in cur:
+                if self.size <= config.cache.max_bytes:
+                    break
+                keys.append((key,))
+                self.size -= size
+        finally:
+            await cur.close()
+        await self._conn.executemany(self._remove_query, keys)
+        logger.debug(f"{len(keys)} entries evicted from the cache")
+
+    async def remove(self, key: Hashable):
+        await self._conn.execute(self._remove_query, (repr(key),))
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+_lookups = metrics.Counter(
+    "cache_lookups_total", "response cache lookups", ("result",)
+)
+_bytes = metrics.Gauge(
+    "cache_bytes", "size of the cached bodies",
+    function=lambda: _store.size if _store is not None else 0
+)
+
+
+def _get_path() -> Path:
+    if config.cache.path:
+        return Path(config.cache.path)
+    return Path(config.database.path).with_name("cache.db")
+
+
+async def init():
+    global _store
+
+    if config.cache.backend == "sqlite":
+        _store = SqliteStore(_get_path())
+    elif config.cache.backend == "memory":
+        _store = MemoryStore()
+    else:
+        raise Exception(f"unknown cache backend: {config.cache.backend}")
+    try:
+        await _store.open()
+    except Sqlite3Error as exc:
+        logger.error(f"error while opening the cache, kept in memory ({exc})")
+        _store = MemoryStore()
+
+
+async def get(key: Hashable, watermark: Optional[int]) -> Optional[CacheEntry]:
+    """Get the cached entry if it was built from the same data"""
+    try:
+        entry = await _store.get(key)
+    except Sqlite3Error as exc:
+        logger.error(f"error while reading the cache ({exc})")
+        return None
+    if entry is None:
+        _lookups.inc("miss")
+        return None
+    if entry.watermark != watermark:
+        _lookups.inc("stale")
+        return None
+    _lookups.inc("hit")
+    return entry
+
+
+async def put(key: Hashable, watermark: Optional[int], body: bytes) -> CacheEntry:
+    """Store the body in the cache, evicting the least recently used entries"""
+    entry = CacheEntry(watermark, hashlib.sha1(body).hexdigest(), body)
+
+    if len(body) > config.cache.max_bytes:
+        logger.debug(f"{key} too big to be cached ({len(body)} bytes)")
+        return entry
+    try:
+        await _store.put(key, entry)
+    except Sqlite3Error as exc:
+        logger.error(f"error while writing the cache ({exc})")
+
+    return entry
+
+
+async def _produce(
+    key: Hashable, watermark: Optional[int], produce: Callable[[], Awaitable[bytes]]
+) -> CacheEntry:
+    return await put(key, watermark, await produce())
+
+
+async def get_or_produce(
+    key: Hashable, watermark: Optional[int], produce: Callable[[], Awaitable[bytes]]
+) -> CacheEntry:
+    """Get the cached entry, or store the body produced if it is missing
+
+    The concurrent callers missing the same entry share a single production.
+    """
+    entry = await get(key, watermark)
+    if entry is None:
+        entry = await singleflight.do(
+            (key, watermark), partial(_produce, key, watermark, produce)
+        )
+    return entry
+
+
+async def close():
+    global _store
+
+    if _store is not None:
+        await _store.close()
+        _store = None
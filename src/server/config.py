@@ -5,20 +5,38 @@ import tomllib
 
 from dotenv import load_dotenv
 
+from server.typem import AdmissionConfig
 from server.typem import AtmosphericPressureConfig
+from server.typem import CacheConfig
 from server.typem import DatabaseConfig
 from server.typem import EventConfig
+from server.typem import ExportConfig
 from server.typem import GeneralConfig
+from server.typem import GraphConfig
 from server.typem import HumidityTemperatureConfig
+from server.typem import IngestConfig
+from server.typem import LiveConfig
+from server.typem import PrerenderConfig
+from server.typem import RenderConfig
+from server.typem import RollupConfig
 from server.typem import ServerConfig
 from server.typem import TriggerType
 
+admission = None
+cache = None
 database = None
 events = []
+export = None
 general = None
+graph = None
 humidity_temperatures = {}
+ingest = None
+live = None
 loggers = {}
 atmospheric_pressure = None
+prerender = None
+render = None
+rollup = None
 server = None
 
 
@@ -50,12 +68,39 @@ def read(config_filename: str):
     global general
     general = GeneralConfig(**raw_config["general"])
 
+    global admission
+    admission = AdmissionConfig(**raw_config.get("admission", {}))
+
+    global export
+    export = ExportConfig(**raw_config.get("export", {}))
+
+    global graph
+    graph = GraphConfig(**raw_config.get("graph", {}))
+
+    global cache
+    cache = CacheConfig(**raw_config.get("cache", {}))
+
     global database
     database = DatabaseConfig(**raw_config["database"])
 
+    global ingest
+    ingest = IngestConfig(**raw_config.get("ingest", {}))
+
+    global live
+    live = LiveConfig(**raw_config.get("live", {}))
+
     global loggers
     loggers = raw_config["logger"]
 
+    global prerender
+    prerender = PrerenderConfig(**raw_config.get("prerender", {}))
+
+    global render
+    render = RenderConfig(**raw_config.get("render", {}))
+
+    global rollup
+    rollup = RollupConfig(**raw_config.get("rollup", {}))
+
     global server
     server = ServerConfig(**raw_config["server"])
 
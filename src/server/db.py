@@ -1,8 +1,19 @@
+from array import array
 import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+from contextlib import asynccontextmanager
 from datetime import datetime
 from datetime import timedelta
+from datetime import timezone
 import logging
+from math import nan
+from pathlib import Path
+import re
+import time
 from typing import AsyncGenerator
+from typing import AsyncIterator
+from typing import Awaitable
 from typing import Optional
 
 import aiosqlite
@@ -10,8 +21,42 @@ from sqlite3 import Error as Sqlite3Error
 from sqlite3 import Row
 
 import server.config as config
+import server.metrics as metrics
 
+# connection used for the writes
 _conn = None
+_write_lock = asyncio.Lock()
+# pool of read-only connections
+_readers = None
+_readers_number = 0
+
+_pool_stats = {
+    "acquisitions": 0,
+    "waits": 0,
+    "wait_time": 0.0,
+    "max_wait_time": 0.0,
+}
+
+# connection and task detecting the new records, queues of the subscribers
+_watcher = None
+_watch_task = None
+_subscribers: set[asyncio.Queue] = set()
+
+# checkout state of each reader, and number of virtual machine steps between
+# two checks of its cancellation
+_leases: dict[aiosqlite.Connection, "_Lease"] = {}
+_PROGRESS_STEPS = 10000
+
+# partitioned mode: months (YYYYMM) of the shard files, oldest first, and
+# shards attached to each reader, least recently used first
+_shard_months: list[str] = []
+_attached: dict[aiosqlite.Connection, OrderedDict[str, None]] = {}
+
+TABLES = ("linky", "on_off", "pressure", "temperature_humidity")
+_from_table = re.compile(r"\bFROM (" + "|".join(TABLES) + r")\b")
+
+# name of the query constants, for the metrics
+_query_names = None
 
 # logger initial setup
 logger = logging.getLogger(__name__)
@@ -20,45 +65,605 @@ logger.setLevel(logging.INFO)
 
 async def init():
     global _conn
+    global _readers
+    global _readers_number
+    global _watcher
+    global _watch_task
 
     try:
         _conn = await aiosqlite.connect(config.database.path, autocommit=True)
+        # in WAL mode, the readers do not block the writer and vice versa
+        await _conn.execute("PRAGMA journal_mode=WAL;")
+        await _tune(_conn)
+
+        _readers = asyncio.Queue()
+        for _ in range(max(1, config.database.readers)):
+            reader = await aiosqlite.connect(config.database.path, autocommit=True)
+            reader.row_factory = Row
+            await reader.execute("PRAGMA query_only=1;")
+            await _tune(reader)
+            _leases[reader] = _Lease()
+            await reader.set_progress_handler(
+                _leases[reader].progress, _PROGRESS_STEPS
+            )
+            _readers.put_nowait(reader)
+            _readers_number += 1
+
+        # PRAGMA data_version is per connection: the watcher needs its own
+        _watcher = await aiosqlite.connect(config.database.path, autocommit=True)
+        _watcher.row_factory = Row
+        await _watcher.execute("PRAGMA query_only=1;")
+        _watch_task = asyncio.create_task(_watch())
+
+        if config.database.partitioned:
+            get_shard_dir().mkdir(parents=True, exist_ok=True)
+            refresh_shards()
     except Sqlite3Error as exc:
-        logger.error(f"error while creating tables ({exc})")
+        logger.error(f"error while opening the database ({exc})")
 
 
-async def get_rows(query: str, *args) -> Optional[list[Row]]:
-    if _conn is not None:
-        cur = await _conn.execute(query, args)
-        return await cur.fetchall()
+async def _tune(conn: aiosqlite.Connection):
+    # a negative cache_size is a number of KiB
+    await conn.execute(f"PRAGMA cache_size=-{config.database.cache_size};")
+    await conn.execute(f"PRAGMA mmap_size={config.database.mmap_size};")
+
+
+class _Lease:
+    """Checkout state of a reader, its statements are aborted once it is
+    cancelled"""
+
+    def __init__(self):
+        self.cancelled = False
+
+    def progress(self) -> int:
+        # called by SQLite in the thread of the connection, a non-zero value
+        # aborts the running statement
+        return 1 if self.cancelled else 0
+
+
+@asynccontextmanager
+async def _reader() -> AsyncIterator[aiosqlite.Connection]:
+    """Check out a connection from the readers pool"""
+    start = time.perf_counter()
+    try:
+        conn = _readers.get_nowait()
+    except asyncio.QueueEmpty:
+        conn = await _readers.get()
+        wait_time = time.perf_counter() - start
+        _pool_stats["waits"] += 1
+        _pool_stats["wait_time"] += wait_time
+        if wait_time > _pool_stats["max_wait_time"]:
+            _pool_stats["max_wait_time"] = wait_time
+        _reader_wait.observe(wait_time)
+        if wait_time > config.database.wait_warning:
+            logger.warning(f"waited {wait_time:.3f}s for a database connection")
+    _pool_stats["acquisitions"] += 1
+
+    try:
+        yield conn
+    finally:
+        lease = _leases[conn]
+        if lease.cancelled:
+            await asyncio.shield(_release(conn, lease))
+        else:
+            _readers.put_nowait(conn)
+
+
+async def _release(conn: aiosqlite.Connection, lease: _Lease):
+    """Give back a cancelled reader once its aborted statement has ended
+
+    The statement may still be queued in the thread of the connection:
+    setting the handler again waits for it.
+    """
+    try:
+        await conn.set_progress_handler(lease.progress, _PROGRESS_STEPS)
+        lease.cancelled = False
+    finally:
+        _readers.put_nowait(conn)
+
+
+async def _interruptible(conn: aiosqlite.Connection, aw: Awaitable):
+    """Await a call of a reader, aborting its statement if cancelled
+
+    The statement runs in the thread of the connection: cancelling the task
+    does not stop it, the connection would stay busy until its end.
+    sqlite3_interrupt() is not used: its flag outlives the statement while
+    another one is open on the connection.
+    """
+    try:
+        return await aw
+    except asyncio.CancelledError:
+        _leases[conn].cancelled = True
+        raise
+
+
+def get_pool_stats() -> dict:
+    """Get the readers pool statistics"""
+    return {
+        "size": _readers_number,
+        "available": _readers.qsize() if _readers is not None else 0,
+        **_pool_stats
+    }
+
+
+_readers_available = metrics.Gauge(
+    "db_readers_available", "read-only connections available in the pool",
+    function=lambda: _readers.qsize() if _readers is not None else 0
+)
+_reader_wait = metrics.Histogram(
+    "db_reader_wait_seconds", "wait for a read-only connection"
+)
+
+
+def get_shard_dir() -> Path:
+    """Get the directory of the monthly shards"""
+    if config.database.shard_dir:
+        return Path(config.database.shard_dir)
+    return Path(config.database.path).with_name("shards")
+
+
+def get_shard_path(month: str) -> Path:
+    return Path(get_shard_dir(), f"{month}.db")
+
+
+def get_month(timestamp: int) -> str:
+    """Get the month (YYYYMM) of the shard holding a timestamp"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m")
+
+
+def get_month_span(month: str) -> tuple[int, int]:
+    """Get the first timestamp of a month and of the next one (UTC)"""
+    year, number = int(month[:4]), int(month[4:])
+    start = datetime(year, number, 1, tzinfo=timezone.utc)
+    if number == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    else:
+        end = datetime(year, number + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def refresh_shards():
+    """Update the list of the shard files"""
+    global _shard_months
+
+    _shard_months = sorted(
+        path.stem for path in get_shard_dir().glob("*.db")
+        if re.fullmatch(r"\d{6}", path.stem)
+    )
+
+
+def _span(start_date: datetime, end_date: datetime) -> tuple[int, int]:
+    return int(start_date.timestamp()), int(end_date.timestamp())
+
+
+def _shard_groups(span: Optional[tuple[int, int]]) -> list[list[str]]:
+    """Get the groups of shards overlapping span to query together
+
+    The groups are in chronological order and have at most max_attached
+    shards: a connection cannot attach many databases. The queries without
+    span only read the main database, which holds the recent months.
+    """
+    if not config.database.partitioned or span is None:
+        return [[]]
+    start, end = span
+    months = [
+        month for month in _shard_months
+        if get_month_span(month)[0] <= end and get_month_span(month)[1] > start
+    ]
+    size = max(1, config.database.max_attached)
+    return [months[i:i + size] for i in range(0, len(months), size)] or [[]]
+
+
+async def _attach(conn: aiosqlite.Connection, months: list[str]):
+    """Attach the shards of months to a reader, detaching the least recently
+    used ones if needed"""
+    attached = _attached.setdefault(conn, OrderedDict())
+    for month in months:
+        if month in attached:
+            attached.move_to_end(month)
+            continue
+        while len(attached) >= config.database.max_attached:
+            oldest = next(m for m in attached if m not in months)
+            await conn.execute(f"DETACH DATABASE shard_{oldest};")
+            del attached[oldest]
+        await conn.execute(
+            f"ATTACH DATABASE ? AS shard_{month};", (str(get_shard_path(month)),)
+        )
+        attached[month] = None
+
+
+def _route(query: str, months: list[str], main: bool = True) -> str:
+    """Rewrite the query to read its table from the shards and, if main, from
+    the main database
+
+    The table is replaced by the UNION ALL of its shards: SQLite pushes the
+    WHERE clause down to each shard and merges their ordered results.
+    """
+    if not months and main:
+        return query
+
+    def union(match: re.Match) -> str:
+        table = match[1]
+        selects = [f"SELECT * FROM shard_{month}.{table}" for month in months]
+        if main:
+            selects.append(f"SELECT * FROM main.{table}")
+        return f"FROM ({' UNION ALL '.join(selects)}) AS {table}"
+
+    return _from_table.sub(union, query)
+
+
+def _routes(query: str, span: Optional[tuple[int, int]]) -> list[tuple[list[str], str]]:
+    """Get the queries to execute in turn, with the shards they read"""
+    groups = _shard_groups(span)
+    return [
+        (months, _route(query, months, main=number == len(groups)))
+        for number, months in enumerate(groups, start=1)
+    ]
+
+
+def _query_name(query: str) -> str:
+    """Get the name of the query constant, without underscore and suffix"""
+    global _query_names
+
+    if _query_names is None:
+        _query_names = {
+            value: name[1:-len("_query")]
+            for name, value in globals().items()
+            if name.startswith("_") and name.endswith("_query") and isinstance(value, str)
+        }
+    return _query_names.get(query, "other")
+
+
+async def get_rows(
+    query: str, *args, span: Optional[tuple[int, int]] = None
+) -> Optional[list[Row]]:
+    """Get all the rows of a query
+
+    In partitioned mode, the shards overlapping span, the (start, end)
+    timestamps of the query, are read too.
+    """
+    if _readers is not None:
+        async with _reader() as conn:
+            start = time.perf_counter()
+            rows = []
+            try:
+                for months, routed_query in _routes(query, span):
+                    await _attach(conn, months)
+                    cur = await _interruptible(conn, conn.execute(routed_query, args))
+                    try:
+                        rows += await _interruptible(conn, cur.fetchall())
+                    finally:
+                        await cur.close()
+            finally:
+                metrics.db_query_duration.observe(
+                    time.perf_counter() - start, _query_name(query)
+                )
+            return rows
     return None
 
 
 async def get_many_rows(
-    query: str, *args, records_number: int = 100
+    query: str, *args, records_number: int = 100,
+    span: Optional[tuple[int, int]] = None
 ) -> AsyncGenerator[list[Row], None]:
-    try:
-        cur = await _conn.execute(query, args)
-    except Sqlite3Error as exc:
-        logger.error(f"error while executing query ({exc})")
+    """Get the rows of a query by batches of records_number rows
+
+    In partitioned mode, the shards overlapping span, the (start, end)
+    timestamps of the query, are read too.
+    """
+    if _readers is None:
         return
-    while True:
-        records = await cur.fetchmany(records_number)
-        if len(records) == 0:
-            break
-        yield records
+    async with _reader() as conn:
+        # only the time spent in the database is measured, not the one
+        # spent by the consumer between two batches
+        duration = 0.0
+        try:
+            for months, routed_query in _routes(query, span):
+                start = time.perf_counter()
+                try:
+                    await _attach(conn, months)
+                    cur = await _interruptible(conn, conn.execute(routed_query, args))
+                except Sqlite3Error as exc:
+                    logger.error(f"error while executing query ({exc})")
+                    return
+                duration += time.perf_counter() - start
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        records = await _interruptible(
+                            conn, cur.fetchmany(records_number)
+                        )
+                        duration += time.perf_counter() - start
+                        if len(records) == 0:
+                            break
+                        yield records
+                finally:
+                    await cur.close()
+        finally:
+            metrics.db_query_duration.observe(duration, _query_name(query))
+
+
+async def get_columns(
+    query: str, *args, typecodes: str, records_number: int = 4096,
+    span: Optional[tuple[int, int]] = None
+) -> Optional[tuple[array, ...]]:
+    """Get each selected column as a typed array
+
+    typecodes holds the array type code of each column, NULL values of the
+    floating point columns are converted to NaN. In partitioned mode, the
+    shards overlapping span, the (start, end) timestamps of the query, are
+    read too.
+    """
+    if _readers is None:
+        return None
+
+    columns = tuple(array(typecode) for typecode in typecodes)
+    async with _reader() as conn:
+        start = time.perf_counter()
+        try:
+            for months, routed_query in _routes(query, span):
+                await _attach(conn, months)
+                cur = await _interruptible(conn, conn.execute(routed_query, args))
+                # plain tuples are cheaper than Row objects
+                cur.row_factory = None
+                try:
+                    while True:
+                        records = await _interruptible(
+                            conn, cur.fetchmany(records_number)
+                        )
+                        if len(records) == 0:
+                            break
+                        for column, values in zip(columns, zip(*records)):
+                            values = list(values)
+                            try:
+                                column.fromlist(values)
+                            except TypeError:
+                                column.fromlist(
+                                    [nan if v is None else v for v in values]
+                                )
+                finally:
+                    await cur.close()
+        finally:
+            metrics.db_query_duration.observe(
+                time.perf_counter() - start, _query_name(query)
+            )
+    return columns
+
+
+async def get_query_plan(query: str, *args) -> Optional[list[Row]]:
+    """Get the EXPLAIN QUERY PLAN rows of a query
+
+    The writer connection is used: EXPLAIN does not check that the schema
+    known by a connection is up to date, and the readers may have been
+    opened before the migrations.
+    """
+    if _conn is not None:
+        cur = await _conn.execute(f"EXPLAIN QUERY PLAN {query}", args)
+        try:
+            return await cur.fetchall()
+        finally:
+            await cur.close()
+    return None
 
 
 async def execute_query(query: str, *args):
     if _conn is not None:
+        async with _write_lock:
+            try:
+                await _conn.execute(query, args)
+            except Sqlite3Error as exc:
+                logger.error(f"error while executing query ({exc})")
+
+
+async def execute_transaction(queries: list[str]):
+    """Execute the queries, without arguments, in a single transaction
+
+    Raises sqlite3.Error if the transaction has been rolled back.
+    """
+    await execute_batch([(query, None) for query in queries])
+
+
+async def execute_batch(statements: list[tuple[str, Optional[list[tuple]]]]):
+    """Execute each query with its list of arguments in a single transaction
+
+    A query whose list of arguments is None is executed once without
+    arguments. Raises sqlite3.Error if the transaction has been rolled back.
+    """
+    if _conn is None:
+        return
+    async with _write_lock:
+        await _conn.execute("BEGIN;")
+        try:
+            for query, args in statements:
+                if args is None:
+                    await _conn.execute(query)
+                else:
+                    await _conn.executemany(query, args)
+        except Sqlite3Error:
+            await _conn.execute("ROLLBACK;")
+            raise
+        await _conn.execute("COMMIT;")
+
+
+async def move_to_shard(month: str, start: int, end: int):
+    """Move the records of all the tables whose timestamp is in [start, end)
+    from the main database to the shard of month
+
+    The shard must exist. Raises sqlite3.Error if the move has been rolled
+    back.
+    """
+    if _conn is None:
+        return
+    async with _write_lock:
+        await _conn.execute(
+            "ATTACH DATABASE ? AS shard;", (str(get_shard_path(month)),)
+        )
         try:
-            await _conn.execute(query, args)
+            # the transaction is atomic in each file, not across files: a
+            # crash may leave records in both files, but never lose any
+            await _conn.execute("BEGIN;")
+            try:
+                for table in TABLES:
+                    await _conn.execute(
+                        f"INSERT INTO shard.{table} SELECT * FROM main.{table} "
+                        "WHERE timestamp >= ? AND timestamp < ?;", (start, end)
+                    )
+                    await _conn.execute(
+                        f"DELETE FROM main.{table} "
+                        "WHERE timestamp >= ? AND timestamp < ?;", (start, end)
+                    )
+            except Sqlite3Error:
+                await _conn.execute("ROLLBACK;")
+                raise
+            await _conn.execute("COMMIT;")
+        finally:
+            await _conn.execute("DETACH DATABASE shard;")
+
+
+_live_marks_query = (
+    "SELECT "
+    "(SELECT MAX(rowid) FROM linky), "
+    "(SELECT MAX(rowid) FROM on_off), "
+    "(SELECT MAX(rowid) FROM pressure), "
+    "(SELECT MAX(rowid) FROM temperature_humidity);"
+)
+_live_linky_query = (
+    "SELECT rowid, east, sinst, timestamp FROM linky "
+    "WHERE rowid > ? ORDER BY rowid LIMIT ?;"
+)
+_live_on_off_query = (
+    "SELECT rowid, device, state, timestamp FROM on_off "
+    "WHERE rowid > ? ORDER BY rowid LIMIT ?;"
+)
+_live_pressure_query = (
+    "SELECT rowid, pressure, timestamp FROM pressure "
+    "WHERE rowid > ? ORDER BY rowid LIMIT ?;"
+)
+_live_temperature_humidity_query = (
+    "SELECT rowid, device, humidity, temperature, timestamp FROM temperature_humidity "
+    "WHERE rowid > ? ORDER BY rowid LIMIT ?;"
+)
+# in the order of the columns of _live_marks_query
+_live_queries = {
+    "linky": _live_linky_query,
+    "on_off": _live_on_off_query,
+    "pressure": _live_pressure_query,
+    "temperature_humidity": _live_temperature_humidity_query,
+}
+
+
+def subscribe() -> asyncio.Queue:
+    """Get a queue receiving the (table, rows) of the new records
+
+    None is received when the subscription ends: on shutdown, or when the
+    subscriber does not keep up and its queue is full.
+    """
+    queue = asyncio.Queue(maxsize=config.live.max_pending)
+    _subscribers.add(queue)
+    return queue
+
+
+def unsubscribe(queue: asyncio.Queue):
+    _subscribers.discard(queue)
+
+
+def _publish(event: Optional[tuple[str, list[dict]]]):
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("live subscriber too slow, unsubscribed")
+            _subscribers.discard(queue)
+            # make room for the end of subscription
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+async def _fetch_marks() -> dict[str, int]:
+    cur = await _watcher.execute(_live_marks_query)
+    try:
+        row = await cur.fetchone()
+    finally:
+        await cur.close()
+    return {table: mark or 0 for table, mark in zip(_live_queries, row)}
+
+
+async def _watch():
+    """Publish the records added since the last check to the subscribers
+
+    A single watcher polls the database for all the subscribers. The cheap
+    PRAGMA data_version tells whether another connection has committed; the
+    tables are then read from their last seen rowid.
+    """
+    data_version = None
+    marks = None
+    while True:
+        await asyncio.sleep(config.live.interval)
+        if not _subscribers:
+            # forget the marks, the next subscribers only want newer records
+            marks = None
+            continue
+        try:
+            cur = await _watcher.execute("PRAGMA data_version;")
+            try:
+                version = (await cur.fetchone())[0]
+            finally:
+                await cur.close()
+            if marks is None:
+                marks = await _fetch_marks()
+                data_version = version
+                continue
+            if version == data_version:
+                continue
+            data_version = version
+
+            for table, query in _live_queries.items():
+                while True:
+                    cur = await _watcher.execute(
+                        query, (marks[table], config.live.batch_size)
+                    )
+                    try:
+                        rows = await cur.fetchall()
+                    finally:
+                        await cur.close()
+                    if len(rows) == 0:
+                        break
+                    marks[table] = rows[-1]["rowid"]
+                    _publish((table, [dict(row) for row in rows]))
+                    if len(rows) < config.live.batch_size:
+                        break
         except Sqlite3Error as exc:
-            logger.error(f"error while executing query ({exc})")
+            logger.error(f"error while watching the database ({exc})")
 
 
 async def close():
     global _conn
+    global _readers
+    global _readers_number
+    global _watcher
+    global _watch_task
+
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except asyncio.CancelledError:
+            pass
+        _watch_task = None
+    _publish(None)
+    _subscribers.clear()
+    if _watcher is not None:
+        await _watcher.close()
+        _watcher = None
+
+    if _readers is not None:
+        while not _readers.empty():
+            await _readers.get_nowait().close()
+        _readers = None
+        _readers_number = 0
+    _attached.clear()
+    _leases.clear()
 
     if _conn is not None:
         await _conn.close()
@@ -77,23 +682,75 @@ async def get_all_linky_records(
 ) -> Optional[list[Row]]:
     """Get the linky data from the linky table"""
     return await get_rows(
-        _linky_query, int(start_date.timestamp()), int(end_date.timestamp())
+        _linky_query, int(start_date.timestamp()), int(end_date.timestamp()),
+        span=_span(start_date, end_date)
     )
 
 
 async def get_linky_records(
-    start_date: datetime, end_date: datetime
-) -> AsyncGenerator[list[dict], None]:
+    start_date: datetime, end_date: datetime, records_number: int = 100
+) -> AsyncGenerator[list[Row], None]:
     """Get the linky data from the linky table"""
-    async for sss in get_many_rows(
-        _linky_query, int(start_date.timestamp()), int(end_date.timestamp())
-    ):
-        yield sss
+    rows = get_many_rows(
+        _linky_query, int(start_date.timestamp()), int(end_date.timestamp()),
+        records_number=records_number, span=_span(start_date, end_date)
+    )
+    # closed at once, so that the reader goes back to the pool
+    async with aclosing(rows):
+        async for sss in rows:
+            yield sss
+
+
+_linky_series_query = (
+    "SELECT timestamp, sinst FROM linky "
+    "WHERE timestamp >= ? AND timestamp <= ? "
+    "ORDER BY timestamp;"
+)
+
+
+async def get_linky_series(
+    start_date: datetime, end_date: datetime
+) -> Optional[tuple[array, array]]:
+    """Get the timestamp and sinst columns of the linky table"""
+    return await get_columns(
+        _linky_series_query,
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        typecodes="qd", span=_span(start_date, end_date)
+    )
+
+
+_linky_buckets_query = (
+    "SELECT timestamp / ? * ? AS bucket, MIN(sinst), MAX(sinst), AVG(sinst) "
+    "FROM linky "
+    "WHERE timestamp >= ? AND timestamp <= ? "
+    "GROUP BY bucket ORDER BY bucket;"
+)
+
+
+async def get_linky_buckets(
+    start_date: datetime, end_date: datetime, bucket: int
+) -> Optional[tuple[array, ...]]:
+    """Get the bucket, min, max and mean of sinst columns per bucket of
+    seconds"""
+    return await get_columns(
+        _linky_buckets_query, bucket, bucket,
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        typecodes="qddd", span=_span(start_date, end_date)
+    )
+
+
+_linky_last_query = "SELECT MAX(timestamp) FROM linky;"
+
+
+async def get_last_linky_timestamp() -> Optional[int]:
+    """Get the timestamp of the newest record of the linky table"""
+    rows = await get_rows(_linky_last_query)
+    return rows[0][0] if rows else None
 
 
 _on_off_query = (
     "SELECT * FROM on_off "
-    "WHERE device=$1 AND timestamp >= ? AND timestamp <= ? "
+    "WHERE device=? AND timestamp >= ? AND timestamp <= ? "
     "ORDER BY timestamp;"
 )
 
@@ -104,19 +761,68 @@ async def get_all_on_off_records(
     """Get the on_off data from the on_off table"""
     return await get_rows(
         _on_off_query, device,
-        int(start_date.timestamp()), int(end_date.timestamp())
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        span=_span(start_date, end_date)
     )
 
 
+_on_off_all_devices_query = (
+    "SELECT * FROM on_off "
+    "WHERE timestamp >= ? AND timestamp <= ? "
+    "ORDER BY timestamp;"
+)
+
+
 async def get_on_off_records(
-    device: str, start_date: datetime, end_date: datetime
-) -> AsyncGenerator[list[dict], None]:
-    """Get the on_off data from the on_off table"""
-    async for sss in get_many_rows(
-        _on_off_query, device,
-        int(start_date.timestamp()), int(end_date.timestamp())
-    ):
-        yield sss
+    device: Optional[str], start_date: datetime, end_date: datetime,
+    records_number: int = 100
+) -> AsyncGenerator[list[Row], None]:
+    """Get the on_off data of a device, or of all devices if device is None,
+    from the on_off table"""
+    if device is None:
+        query = _on_off_all_devices_query
+        args = ()
+    else:
+        query = _on_off_query
+        args = (device,)
+    rows = get_many_rows(
+        query, *args, int(start_date.timestamp()), int(end_date.timestamp()),
+        records_number=records_number, span=_span(start_date, end_date)
+    )
+    # closed at once, so that the reader goes back to the pool
+    async with aclosing(rows):
+        async for sss in rows:
+            yield sss
+
+
+_on_off_dates_query = (
+    "SELECT device, "
+    "strftime('%Y/%m/%d %H:%M', timestamp, 'unixepoch', 'localtime') "
+    "FROM on_off "
+    "WHERE device IN ({devices}) AND timestamp >= ? AND timestamp <= ? "
+    "ORDER BY timestamp;"
+)
+
+
+async def get_on_off_dates(
+    devices: list[str], start_date: datetime, end_date: datetime
+) -> Optional[list[Row]]:
+    """Get the device and the formatted local date of the on_off records of
+    several devices in a single query"""
+    return await get_rows(
+        _on_off_dates_query.format(devices=", ".join("?" * len(devices))),
+        *devices, int(start_date.timestamp()), int(end_date.timestamp()),
+        span=_span(start_date, end_date)
+    )
+
+
+_on_off_last_query = "SELECT MAX(timestamp) FROM on_off;"
+
+
+async def get_last_on_off_timestamp() -> Optional[int]:
+    """Get the timestamp of the newest record of the on_off table"""
+    rows = await get_rows(_on_off_last_query)
+    return rows[0][0] if rows else None
 
 
 _pressure_query = (
@@ -131,18 +837,71 @@ async def get_all_pressure_records(
 ) -> Optional[list[Row]]:
     """Get the pressure data from the pressure table"""
     return await get_rows(
-        _pressure_query, int(start_date.timestamp()), int(end_date.timestamp())
+        _pressure_query, int(start_date.timestamp()), int(end_date.timestamp()),
+        span=_span(start_date, end_date)
     )
 
 
 async def get_pressure_records(
-    start_date: datetime, end_date: datetime
-) -> AsyncGenerator[list[dict], None]:
+    start_date: datetime, end_date: datetime, records_number: int = 100
+) -> AsyncGenerator[list[Row], None]:
     """Get the pressure data from the pressure table"""
-    async for prs in get_many_rows(
-        _pressure_query, int(start_date.timestamp()), int(end_date.timestamp())
-    ):
-        yield sss
+    rows = get_many_rows(
+        _pressure_query, int(start_date.timestamp()), int(end_date.timestamp()),
+        records_number=records_number, span=_span(start_date, end_date)
+    )
+    # closed at once, so that the reader goes back to the pool
+    async with aclosing(rows):
+        async for prs in rows:
+            yield prs
+
+
+_pressure_series_query = (
+    "SELECT timestamp, pressure FROM pressure "
+    "WHERE timestamp >= ? AND timestamp <= ? "
+    "ORDER BY timestamp;"
+)
+
+
+async def get_pressure_series(
+    start_date: datetime, end_date: datetime
+) -> Optional[tuple[array, array]]:
+    """Get the timestamp and pressure columns of the pressure table"""
+    return await get_columns(
+        _pressure_series_query,
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        typecodes="qd", span=_span(start_date, end_date)
+    )
+
+
+_pressure_buckets_query = (
+    "SELECT timestamp / ? * ? AS bucket, "
+    "MIN(pressure), MAX(pressure), AVG(pressure) "
+    "FROM pressure "
+    "WHERE timestamp >= ? AND timestamp <= ? "
+    "GROUP BY bucket ORDER BY bucket;"
+)
+
+
+async def get_pressure_buckets(
+    start_date: datetime, end_date: datetime, bucket: int
+) -> Optional[tuple[array, ...]]:
+    """Get the bucket, min, max and mean of the pressure columns per bucket
+    of seconds"""
+    return await get_columns(
+        _pressure_buckets_query, bucket, bucket,
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        typecodes="qddd", span=_span(start_date, end_date)
+    )
+
+
+_pressure_last_query = "SELECT MAX(timestamp) FROM pressure;"
+
+
+async def get_last_pressure_timestamp() -> Optional[int]:
+    """Get the timestamp of the newest record of the pressure table"""
+    rows = await get_rows(_pressure_last_query)
+    return rows[0][0] if rows else None
 
 
 _temperature_humidity_query = (
@@ -158,19 +917,76 @@ async def get_all_temperature_humidity_records(
     """Get the data from the temperature_humidity table"""
     return await get_rows(
         _temperature_humidity_query, device,
-        int(start_date.timestamp()), int(end_date.timestamp())
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        span=_span(start_date, end_date)
     )
 
 
 async def get_temperature_humidity_records(
-    device: str, start_date: datetime, end_date: datetime
-) -> AsyncGenerator[list[dict], None]:
+    device: str, start_date: datetime, end_date: datetime,
+    records_number: int = 100
+) -> AsyncGenerator[list[Row], None]:
     """Get the data from the temperature_humidity table"""
-    async for sss in get_many_rows(
+    rows = get_many_rows(
         _temperature_humidity_query, device,
-        int(start_date.timestamp()), int(end_date.timestamp())
-    ):
-        yield sss
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        records_number=records_number, span=_span(start_date, end_date)
+    )
+    # closed at once, so that the reader goes back to the pool
+    async with aclosing(rows):
+        async for sss in rows:
+            yield sss
+
+
+_temperature_humidity_series_query = (
+    "SELECT timestamp, humidity, temperature FROM temperature_humidity "
+    "WHERE device=? AND timestamp >= ? AND timestamp <= ? "
+    "ORDER BY timestamp;"
+)
+
+
+async def get_temperature_humidity_series(
+    device: str, start_date: datetime, end_date: datetime
+) -> Optional[tuple[array, array, array]]:
+    """Get the timestamp, humidity and temperature columns of a device"""
+    return await get_columns(
+        _temperature_humidity_series_query, device,
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        typecodes="qdd", span=_span(start_date, end_date)
+    )
+
+
+_temperature_humidity_buckets_query = (
+    "SELECT timestamp / ? * ? AS bucket, "
+    "MIN(humidity), MAX(humidity), AVG(humidity), "
+    "MIN(temperature), MAX(temperature), AVG(temperature) "
+    "FROM temperature_humidity "
+    "WHERE device=? AND timestamp >= ? AND timestamp <= ? "
+    "GROUP BY bucket ORDER BY bucket;"
+)
+
+
+async def get_temperature_humidity_buckets(
+    device: str, start_date: datetime, end_date: datetime, bucket: int
+) -> Optional[tuple[array, ...]]:
+    """Get the bucket, min, max and mean of humidity and min, max and mean of
+    temperature columns per bucket of seconds"""
+    return await get_columns(
+        _temperature_humidity_buckets_query, bucket, bucket, device,
+        int(start_date.timestamp()), int(end_date.timestamp()),
+        typecodes="qdddddd", span=_span(start_date, end_date)
+    )
+
+
+_temperature_humidity_last_query = (
+    "SELECT MAX(timestamp) FROM temperature_humidity WHERE device=?;"
+)
+
+
+async def get_last_temperature_humidity_timestamp(device: str) -> Optional[int]:
+    """Get the timestamp of the newest record of a temperature_humidity device"""
+    rows = await get_rows(_temperature_humidity_last_query, device)
+    return rows[0][0] if rows else None
 
 
 async def run(config_filename: str):
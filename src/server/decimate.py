@@ -0,0 +1,114 @@
+from array import array
+import json
+import struct
+
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Get the indices of the points kept by the Largest-Triangle-Three-Buckets
+    algorithm
+
+    The first and last points are kept; in each bucket between them, the point
+    forming the largest triangle with the previously kept point and the mean
+    of the next bucket is kept. The NaN values are never kept unless a bucket
+    has no other value. y is a column, or a 2D array of columns sharing the
+    selection, the area of a point being the sum of its areas in the columns.
+    """
+    y = np.atleast_2d(y)
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1])
+
+    # points - 2 buckets of at least one point between the first and the last
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    indices = np.empty(points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    # the empty buckets divide by a zero count
+    with np.errstate(invalid="ignore"):
+        for i in range(points - 2):
+            lo, hi = edges[i], edges[i + 1]
+            if i + 2 < len(edges):
+                next_lo, next_hi = edges[i + 1], edges[i + 2]
+            else:
+                next_lo, next_hi = n - 1, n
+            next_y = y[:, next_lo:next_hi]
+            counts = (~np.isnan(next_y)).sum(axis=1)
+            mean_x = x[next_lo:next_hi].mean()
+            # the mean of a column without value in the next bucket is its last
+            # kept value
+            mean_y = np.where(
+                counts > 0, np.nansum(next_y, axis=1) / counts, y[:, a]
+            )
+
+            areas = np.abs(
+                (x[a] - mean_x) * (y[:, lo:hi] - y[:, a, None])
+                - (x[a] - x[lo:hi]) * (mean_y - y[:, a])[:, None]
+            )
+            totals = np.nansum(areas, axis=0)
+            totals[np.isnan(areas).all(axis=0)] = -1.0
+            a = lo + int(np.argmax(totals))
+            indices[i + 1] = a
+    return indices
+
+
+def _normalize(y: np.ndarray) -> np.ndarray:
+    """Scale a column to [0, 1] so that the columns weigh the same in LTTB"""
+    finite = y[~np.isnan(y)]
+    if len(finite) == 0:
+        return y
+    low, high = finite.min(), finite.max()
+    return (y - low) / (high - low) if high > low else y - low
+
+
+def _decimate(
+    timestamps: array, columns: list[array], points: int
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """Keep at most points points of the columns, selected by LTTB on all the
+    columns at once"""
+    t = np.frombuffer(timestamps, dtype=np.int64)
+    values = [np.frombuffer(column, dtype=np.float64) for column in columns]
+    if len(t) == 0:
+        return t, values
+    x = t.astype(np.float64)
+    indices = lttb(x, np.vstack([_normalize(y) for y in values]), points)
+    return t[indices], [y[indices] for y in values]
+
+
+def _encode_json(t: np.ndarray, names: list[str], values: list[np.ndarray]) -> bytes:
+    data = {
+        "start": int(t[0]) if len(t) else None,
+        "deltas": np.diff(t).tolist(),
+        "columns": {
+            name: [None if v != v else v for v in np.round(y, 3).tolist()]
+            for name, y in zip(names, values)
+        },
+    }
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _encode_binary(t: np.ndarray, names: list[str], values: list[np.ndarray]) -> bytes:
+    # little-endian: point and column numbers, first timestamp, then the
+    # timestamp deltas and each column as float32 (NaN for the missing values)
+    header = struct.pack("<IHq", len(t), len(values), int(t[0]) if len(t) else 0)
+    return b"".join(
+        [header, np.diff(t).astype("<i4").tobytes()]
+        + [y.astype("<f4").tobytes() for y in values]
+    )
+
+
+_ENCODERS = {"json": _encode_json, "binary": _encode_binary}
+
+
+def encode(
+    timestamps: array, columns: dict[str, array], points: int, series_format: str
+) -> bytes:
+    """Decimate the columns to at most points points and encode them (run in
+    a render worker)"""
+    t, values = _decimate(timestamps, list(columns.values()), points)
+    return _ENCODERS[series_format](t, list(columns), values)
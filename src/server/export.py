@@ -0,0 +1,241 @@
+from contextlib import aclosing
+from datetime import datetime
+from io import BytesIO
+import json
+import logging
+from typing import AsyncGenerator
+from typing import Optional
+import zlib
+
+from aiohttp import hdrs
+from aiohttp import web
+
+import server.config as config
+import server.metrics as metrics
+from server.typem import ExportColumn
+from server.typem import ServerError
+
+# zlib window bits of the supported content codings, by order of preference
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def accepted_encoding(request: web.Request) -> Optional[str]:
+    """Get the preferred content coding accepted by the client, None for
+    identity"""
+    qualities = {}
+    for item in request.headers.get(hdrs.ACCEPT_ENCODING, "").split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    for coding in _WBITS:
+        if qualities.get(coding, qualities.get("*", 0.0)) > 0.0:
+            return coding
+    return None
+
+
+class CsvEncoder:
+    content_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, columns: tuple[ExportColumn, ...]):
+        self._header = ", ".join(column.name for column in columns) + "\n"
+        # str.format() template, the constant values are inlined
+        self._row_format = ", ".join(
+            f"{{{column.index}}}" if column.index is not None
+            else str(column.value).replace("{", "{{").replace("}", "}}")
+            for column in columns
+        ) + "\n"
+
+    def header(self) -> bytes:
+        return self._header.encode()
+
+    def encode(self, records: list) -> bytes:
+        row_format = self._row_format
+        return "".join([row_format.format(*record) for record in records]).encode()
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class NdjsonEncoder:
+    content_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, columns: tuple[ExportColumn, ...]):
+        self._columns = columns
+        self._dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, records: list) -> bytes:
+        dumps = self._dumps
+        columns = self._columns
+        return "".join([
+            dumps({
+                column.name: (
+                    record[column.index] if column.index is not None
+                    else column.value
+                )
+                for column in columns
+            }) + "\n"
+            for record in records
+        ]).encode()
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class ArrowEncoder:
+    """Arrow IPC stream, one record batch per database batch"""
+    content_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+
+    def __init__(self, columns: tuple[ExportColumn, ...]):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+        except ImportError as exc:
+            raise ServerError("arrow format not available (pyarrow missing)") from exc
+
+        self._pa = pyarrow
+        types = {"int": pyarrow.int64(), "float": pyarrow.float64(), "str": pyarrow.string()}
+        self._columns = columns
+        self._schema = pyarrow.schema(
+            [(column.name, types[column.type]) for column in columns]
+        )
+        self._sink = BytesIO()
+        self._writer = pyarrow.ipc.new_stream(self._sink, self._schema)
+
+    def _pull(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def header(self) -> bytes:
+        return self._pull()
+
+    def encode(self, records: list) -> bytes:
+        values = list(zip(*records))
+        arrays = [
+            self._pa.array(
+                values[column.index] if column.index is not None
+                else [column.value] * len(records),
+                type=field.type
+            )
+            for column, field in zip(self._columns, self._schema)
+        ]
+        self._writer.write_batch(
+            self._pa.record_batch(arrays, schema=self._schema)
+        )
+        return self._pull()
+
+    def footer(self) -> bytes:
+        self._writer.close()
+        return self._pull()
+
+
+FORMATS = {
+    "csv": CsvEncoder,
+    "ndjson": NdjsonEncoder,
+    "arrow": ArrowEncoder,
+}
+
+
+class ChunkWriter:
+    """Accumulate data in a buffer and write it by chunks, compressed or not
+
+    The sink is a response, or any object with the same write and write_eof
+    coroutines. The writes wait for the response buffer to drain, so the
+    producer is slowed down to the pace of the client.
+    """
+
+    def __init__(self, sink: web.StreamResponse, encoding: Optional[str]):
+        self._sink = sink
+        self._buffer = bytearray()
+        if encoding is None:
+            self._compressor = None
+        else:
+            self._compressor = zlib.compressobj(
+                config.export.compression_level, zlib.DEFLATED, _WBITS[encoding]
+            )
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        if len(self._buffer) >= config.export.chunk_size:
+            await self._flush()
+
+    async def _flush(self):
+        if self._compressor is None:
+            chunk = bytes(self._buffer)
+        else:
+            chunk = self._compressor.compress(self._buffer)
+        self._buffer.clear()
+        if len(chunk) != 0:
+            await self._sink.write(chunk)
+
+    async def close(self):
+        await self._flush()
+        if self._compressor is not None:
+            await self._sink.write(self._compressor.flush())
+        await self._sink.write_eof()
+
+
+async def write_export(
+    sink: web.StreamResponse, encoding: Optional[str], encoder,
+    name: str, export_format: str, records: AsyncGenerator
+):
+    """Write the records encoded by encoder to the sink
+
+    The records generator is closed even if the client goes away, so that its
+    database connection is released at once rather than when it is collected.
+    """
+    writer = ChunkWriter(sink, encoding)
+    rows = 0
+    await writer.write(encoder.header())
+    async with aclosing(records):
+        async for batch in records:
+            rows += len(batch)
+            await writer.write(encoder.encode(batch))
+    await writer.write(encoder.footer())
+    await writer.close()
+    metrics.export_rows.observe(rows, name, export_format)
+
+
+async def stream_export(
+    request: web.Request, name: str, export_format: str,
+    columns: tuple[ExportColumn, ...], records: AsyncGenerator
+) -> web.StreamResponse:
+    """Stream the records as an attachment in the requested format
+
+    Raises ServerError if the format is not available.
+    """
+    encoder = FORMATS[export_format](columns)
+    encoding = accepted_encoding(request)
+
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d%H%M%S')}.{encoder.extension}"
+    headers = {
+        hdrs.CONTENT_TYPE: encoder.content_type,
+        hdrs.CONTENT_DISPOSITION: f"Attachment; filename={filename}",
+        hdrs.VARY: hdrs.ACCEPT_ENCODING,
+    }
+    if encoding is not None:
+        headers[hdrs.CONTENT_ENCODING] = encoding
+    response = web.StreamResponse(status=200, reason="OK", headers=headers)
+    await response.prepare(request)
+
+    await write_export(response, encoding, encoder, name, export_format, records)
+
+    return response
@@ -0,0 +1,266 @@
+import asyncio
+from datetime import datetime
+from functools import partial
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import AsyncGenerator
+from typing import Optional
+import zlib
+
+from aiohttp import hdrs
+from aiohttp import web
+
+import server.admission as admission
+import server.config as config
+from server.export import accepted_encoding
+from server.export import FORMATS
+from server.export import write_export
+import server.metrics as metrics
+import server.singleflight as singleflight
+from server.typem import ExportColumn
+
+# the exports are stored once per content, as objects/<sha256>.gz, and
+# refs/<sha256 of the request> holds the name of the object of a request
+_dir = None
+_size = 0
+
+# a closed range never changes: the clients may keep it forever
+_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# the temporary files older than this are left by a crash
+_TMP_MAX_AGE = 86400.0
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_lookups = metrics.Counter(
+    "export_cache_lookups_total", "export cache lookups", ("result",)
+)
+_bytes = metrics.Gauge(
+    "export_cache_bytes", "size of the cached exports", function=lambda: _size
+)
+
+
+class _FileSink:
+    """ChunkWriter sink writing to a file and hashing what is written
+
+    The file is written in a thread, not to block the event loop.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self.hash = hashlib.sha256()
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self.hash.update(data)
+
+    async def write(self, data: bytes):
+        await asyncio.to_thread(self._write, data)
+
+    async def write_eof(self):
+        await asyncio.to_thread(self._file.flush)
+
+
+def _get_dir() -> Path:
+    if config.export.cache_dir:
+        return Path(config.export.cache_dir)
+    return Path(config.database.path).with_name("exports")
+
+
+def _scan() -> list[tuple[float, int, Path]]:
+    """Get the last access time, the size and the path of each object"""
+    objects = []
+    for path in (_dir / "objects").iterdir():
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            # evicted by another process
+            continue
+        if path.suffix == ".tmp":
+            if st.st_mtime < time.time() - _TMP_MAX_AGE:
+                path.unlink(missing_ok=True)
+            continue
+        objects.append((st.st_atime, st.st_size, path))
+    return objects
+
+
+def init():
+    global _dir, _size
+
+    if config.export.cache_max_bytes <= 0:
+        return
+    _dir = _get_dir()
+    (_dir / "objects").mkdir(parents=True, exist_ok=True)
+    (_dir / "refs").mkdir(exist_ok=True)
+    _size = sum(size for _, size, _ in _scan())
+    logger.debug(f"export cache of {_size} bytes in {_dir}")
+
+
+def is_cacheable(end_date: datetime) -> bool:
+    """Tell if the export ending at end_date can no longer change"""
+    return (
+        _dir is not None
+        and end_date.timestamp() < time.time() - config.export.late_arrival
+    )
+
+
+def _get_ref_path(key: tuple) -> Path:
+    return _dir / "refs" / hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def _lookup(ref_path: Path) -> Optional[Path]:
+    try:
+        path = _dir / "objects" / f"{ref_path.read_text()}.gz"
+        st = path.stat()
+    except FileNotFoundError:
+        # missing ref, or object evicted
+        ref_path.unlink(missing_ok=True)
+        return None
+    # the access time orders the eviction; the modification time is kept, it
+    # is part of the ETag
+    os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+    return path
+
+
+def _write_ref(ref_path: Path, digest: str):
+    fd, tmp = tempfile.mkstemp(dir=_dir / "refs", suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        file.write(digest)
+    os.replace(tmp, ref_path)
+
+
+def _evict(kept: Path):
+    """Remove the least recently used objects until the cache fits"""
+    global _size
+
+    # the other processes add objects too
+    objects = sorted(_scan())
+    _size = sum(size for _, size, _ in objects)
+    for _, size, path in objects:
+        if _size <= config.export.cache_max_bytes:
+            break
+        if path == kept:
+            continue
+        path.unlink(missing_ok=True)
+        _size -= size
+        logger.debug(f"{path.name} evicted from the export cache")
+
+
+async def _produce(
+    ref_path: Path, name: str, export_format: str,
+    columns: tuple[ExportColumn, ...], records: AsyncGenerator
+) -> Path:
+    global _size
+
+    encoder = FORMATS[export_format](columns)
+    # the hits and the requests sharing this production take no slot
+    async with admission.slot("export"):
+        fd, tmp = tempfile.mkstemp(dir=_dir / "objects", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                sink = _FileSink(file)
+                await write_export(
+                    sink, "gzip", encoder, name, export_format, records
+                )
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    path = _dir / "objects" / f"{sink.hash.hexdigest()}.gz"
+    if path.exists():
+        # same content as another range
+        os.unlink(tmp)
+    else:
+        os.replace(tmp, path)
+        _size += path.stat().st_size
+    _write_ref(ref_path, sink.hash.hexdigest())
+
+    if _size > config.export.cache_max_bytes:
+        _evict(path)
+    return path
+
+
+def _read_decompressed(file, decompressor) -> Optional[bytes]:
+    """Read and decompress the next chunk of an object, None at its end"""
+    chunk = file.read(config.export.chunk_size)
+    if not chunk:
+        return None
+    return decompressor.decompress(chunk)
+
+
+async def _stream_decompressed(
+    request: web.Request, path: Path, headers: dict
+) -> web.StreamResponse:
+    """Stream the object to a client not accepting gzip"""
+    response = web.StreamResponse(status=200, reason="OK", headers=headers)
+    await response.prepare(request)
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with path.open("rb") as file:
+        # the object is read in a thread, not to block the event loop
+        while (data := await asyncio.to_thread(
+            _read_decompressed, file, decompressor
+        )) is not None:
+            await response.write(data)
+    await response.write(decompressor.flush())
+    await response.write_eof()
+    return response
+
+
+async def cached_export(
+    request: web.Request, name: str, export_format: str,
+    columns: tuple[ExportColumn, ...], records: AsyncGenerator,
+    start_date: datetime, end_date: datetime
+) -> web.StreamResponse:
+    """Serve the export of a closed range from the cache, storing it first if
+    it is missing
+
+    The gzipped object is sent as is, with Range support; it is decompressed
+    for the clients not accepting gzip. Raises ServerError if the format is
+    not available.
+    """
+    key = (
+        name, export_format, columns,
+        int(start_date.timestamp()), int(end_date.timestamp())
+    )
+    ref_path = _get_ref_path(key)
+    path = _lookup(ref_path)
+    if path is None:
+        _lookups.inc("miss")
+        path = await singleflight.do(
+            ("export", ref_path.name),
+            partial(_produce, ref_path, name, export_format, columns, records)
+        )
+    else:
+        _lookups.inc("hit")
+
+    encoder_class = FORMATS[export_format]
+    filename = (
+        f"{name}-{start_date.strftime('%Y%m%d%H%M%S')}"
+        f"-{end_date.strftime('%Y%m%d%H%M%S')}.{encoder_class.extension}"
+    )
+    headers = {
+        hdrs.CONTENT_TYPE: encoder_class.content_type,
+        hdrs.CONTENT_DISPOSITION: f"Attachment; filename={filename}",
+        hdrs.VARY: hdrs.ACCEPT_ENCODING,
+        hdrs.CACHE_CONTROL: _CACHE_CONTROL,
+    }
+    if accepted_encoding(request) != "gzip":
+        return await _stream_decompressed(request, path, headers)
+
+    headers[hdrs.CONTENT_ENCODING] = "gzip"
+    # the ETag, If-None-Match, If-Range and Range headers are handled by
+    # FileResponse, the content is sent with sendfile
+    return web.FileResponse(path, headers=headers)
+
+
+async def close():
+    global _dir
+
+    _dir = None
@@ -0,0 +1,248 @@
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timezone
+from functools import partial
+from io import BytesIO
+from typing import Callable
+from typing import Optional
+
+from dateutil import tz
+import matplotlib
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+import numpy as np
+from qbstyles import mpl_style
+
+from server.graph import DPI
+from server.graph import LINKY_FIGSIZE
+from server.graph import PRESSURE_FIGSIZE
+from server.graph import TEMPERATURE_HUMIDITY_FIGSIZE
+
+# the dates are plotted in UTC and displayed in the local time zone
+_tz = tz.tzlocal()
+
+
+def init_worker():
+    """Load matplotlib and apply the style (run in each render worker)"""
+    matplotlib.set_loglevel("info")
+    mpl_style(dark=True)
+
+
+def set_axis_style(ax, aggregated: bool = False):
+    ax.xaxis_date(tz=_tz)
+    ax.tick_params(axis="x", labelsize=12, which="major")
+    if aggregated:
+        # one tick per day and per 3 hours is unreadable on long windows
+        locator = mdates.AutoDateLocator(tz=_tz)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator, tz=_tz))
+    else:
+        ax.xaxis.set_major_locator(mdates.DayLocator(tz=_tz))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter("%d/%m", tz=_tz))
+        ax.xaxis.set_minor_locator(
+            mdates.HourLocator(byhour=range(3, 24, 3), tz=_tz)
+        )
+        ax.xaxis.set_minor_formatter(mdates.DateFormatter("%H:%M", tz=_tz))
+    ax.grid(True, which="both")
+
+
+def _to_mdates(timestamps: array) -> np.ndarray:
+    """Convert epoch timestamps to matplotlib dates without creating
+    datetime objects"""
+    epoch = mdates.date2num(datetime(1970, 1, 1, tzinfo=timezone.utc))
+    return np.frombuffer(timestamps, dtype=np.int64) / 86400.0 + epoch
+
+
+def _to_values(values: array) -> np.ndarray:
+    return np.frombuffer(values, dtype=np.float64)
+
+
+class _Plot:
+    """A line of an axes, and its envelope, whose data change at each render"""
+
+    def __init__(self, ax, **kwargs):
+        self.ax = ax
+        self.line, = ax.plot([], [], **kwargs)
+        self.color = kwargs["color"]
+        self.fill = None
+        # the limits of a new figure without data
+        self.empty_xlim = ax.get_xlim()
+        self.empty_ylim = ax.get_ylim()
+
+    def update(
+        self, dts: np.ndarray, values: array,
+        envelope: Optional[tuple[array, array]], autoscale_y: bool = False
+    ):
+        ys = _to_values(values)
+        self.line.set_data(dts, ys)
+
+        if self.fill is not None:
+            self.fill.remove()
+            self.fill = None
+        if envelope is not None:
+            lows, highs = _to_values(envelope[0]), _to_values(envelope[1])
+            self.fill = self.ax.fill_between(
+                dts, lows, highs, color=self.color, alpha=0.3, linewidth=0
+            )
+        else:
+            lows = highs = ys
+
+        if len(dts) == 0:
+            self.ax.set_xlim(*self.empty_xlim)
+        else:
+            self.ax.set_xlim(*_with_margins(dts[0], dts[-1]))
+        if not autoscale_y:
+            return
+        if np.isfinite(lows).any():
+            self.ax.set_ylim(*_with_margins(np.nanmin(lows), np.nanmax(highs)))
+        else:
+            self.ax.set_ylim(*self.empty_ylim)
+
+
+def _with_margins(low: float, high: float) -> tuple[float, float]:
+    """Get the limits of an axis with the default margins of matplotlib"""
+    if high <= low:
+        return low - 0.5, low + 0.5
+    margin = (high - low) * 0.05
+    return low - margin, high + margin
+
+
+class _Template:
+    """A figure built once, whose plots are updated at each render"""
+
+    def __init__(self, fig: Figure, plots: list[_Plot], rotation: int):
+        self.fig = fig
+        self.plots = plots
+        self.rotation = rotation
+
+    def to_png(self) -> bytes:
+        # the tick labels of the new x limits need the rotation too
+        self.fig.autofmt_xdate(rotation=self.rotation, ha="right", which="both")
+        buf = BytesIO()
+        self.fig.savefig(buf, format="png")
+        return buf.getvalue()
+
+
+# templates by chart and parameters, least recently used first
+_templates: OrderedDict[tuple, _Template] = OrderedDict()
+_MAX_TEMPLATES = 16
+
+
+def _get_template(key: tuple, build: Callable[[], _Template]) -> _Template:
+    """Get the template of key, building it on first use
+
+    A render worker runs one job at a time: a template is never used by two
+    renders at once.
+    """
+    template = _templates.get(key)
+    if template is None:
+        template = build()
+        _templates[key] = template
+        if len(_templates) > _MAX_TEMPLATES:
+            _templates.popitem(last=False)
+    else:
+        _templates.move_to_end(key)
+    return template
+
+
+def _build_linky(aggregated: bool) -> _Template:
+    fig = Figure(figsize=LINKY_FIGSIZE, dpi=DPI, constrained_layout=True)
+    ax = fig.add_subplot()
+
+    ax.set_title("Linky")
+    ax.set_ylabel("VA")
+    set_axis_style(ax, aggregated)
+    return _Template(fig, [_Plot(ax, color="yellow")], rotation=30)
+
+
+def render_linky(
+    timestamps: array, values: array,
+    envelope: Optional[tuple[array, array]] = None
+) -> bytes:
+    """Render the linky figure (run in a render worker)"""
+    aggregated = envelope is not None
+    template = _get_template(
+        ("linky", aggregated), partial(_build_linky, aggregated)
+    )
+    template.plots[0].update(
+        _to_mdates(timestamps), values, envelope, autoscale_y=True
+    )
+    return template.to_png()
+
+
+def _build_pressure(
+    ymin: float, ymax: float, yref: float, aggregated: bool
+) -> _Template:
+    fig = Figure(figsize=PRESSURE_FIGSIZE, dpi=DPI, constrained_layout=True)
+    ax = fig.add_subplot()
+
+    ax.set_title("Pressure")
+    ax.set_ylabel("hPa")
+    ax.set_ylim(auto=False, ymin=ymin, ymax=ymax)
+    set_axis_style(ax, aggregated)
+    ax.axhline(y=yref, color='w', linestyle=':')
+    return _Template(
+        fig, [_Plot(ax, color="limegreen", linewidth=2)], rotation=60
+    )
+
+
+def render_pressure(
+    timestamps: array, values: array,
+    ymin: float, ymax: float, yref: float,
+    envelope: Optional[tuple[array, array]] = None
+) -> bytes:
+    """Render the pressure figure (run in a render worker)"""
+    aggregated = envelope is not None
+    template = _get_template(
+        ("pressure", ymin, ymax, yref, aggregated),
+        partial(_build_pressure, ymin, ymax, yref, aggregated)
+    )
+    template.plots[0].update(_to_mdates(timestamps), values, envelope)
+    return template.to_png()
+
+
+def _build_temperature_humidity(
+    hmin: float, hmax: float, tmin: float, tmax: float, aggregated: bool
+) -> _Template:
+    fig = Figure(
+        figsize=TEMPERATURE_HUMIDITY_FIGSIZE, dpi=DPI, constrained_layout=True
+    )
+    ax1, ax2 = fig.subplots(2, 1)
+
+    ax1.set_title("Humidity")
+    ax1.set_ylabel("%RH")
+    ax1.set_ylim(auto=False, ymin=hmin, ymax=hmax)
+    set_axis_style(ax1, aggregated)
+
+    ax2.set_title("Temperature")
+    ax2.set_ylabel("°C")
+    set_axis_style(ax2, aggregated)
+    ax2.set_ylim(auto=False, ymin=tmin, ymax=tmax)
+
+    return _Template(
+        fig,
+        [
+            _Plot(ax1, color="deepskyblue", linewidth=2),
+            _Plot(ax2, color="orange", linewidth=2),
+        ],
+        rotation=30
+    )
+
+
+def render_temperature_humidity(
+    timestamps: array, hmds: array, tmps: array,
+    hmin: float, hmax: float, tmin: float, tmax: float,
+    h_envelope: Optional[tuple[array, array]] = None,
+    t_envelope: Optional[tuple[array, array]] = None
+) -> bytes:
+    """Render the temperature and humidity figure (run in a render worker)"""
+    aggregated = h_envelope is not None
+    template = _get_template(
+        ("temperature_humidity", hmin, hmax, tmin, tmax, aggregated),
+        partial(_build_temperature_humidity, hmin, hmax, tmin, tmax, aggregated)
+    )
+    dts = _to_mdates(timestamps)
+    template.plots[0].update(dts, hmds, h_envelope)
+    template.plots[1].update(dts, tmps, t_envelope)
+    return template.to_png()
@@ -1,131 +1,172 @@
 from datetime import datetime
 from datetime import timedelta
-from io import BytesIO
+from functools import partial
+from math import ceil
+import time
+from typing import Optional
 
-from dateutil import parser as dateparser
-import matplotlib
-import matplotlib.dates as mdates
-import matplotlib.style
-from matplotlib.figure import Figure
 import pytz
-from qbstyles import mpl_style
 
 import server.config as config
-from server.db import get_all_linky_records
-from server.db import get_all_pressure_records
-from server.db import get_all_temperature_humidity_records
+from server.db import get_last_linky_timestamp
+from server.db import get_last_pressure_timestamp
+from server.db import get_last_temperature_humidity_timestamp
+from server.db import get_linky_buckets
+from server.db import get_linky_series
+from server.db import get_pressure_buckets
+from server.db import get_pressure_series
+from server.db import get_temperature_humidity_buckets
+from server.db import get_temperature_humidity_series
+import server.metrics as metrics
+import server.render as render
+from server.typem import Chart
+
+DPI = 100
+LINKY_FIGSIZE = (10, 4)
+PRESSURE_FIGSIZE = (10, 4)
+TEMPERATURE_HUMIDITY_FIGSIZE = (10, 8)
+
+# the figures are drawn by server.figures, which loads matplotlib: it is
+# named so that only the render workers import it
+_FIGURES = "server.figures"
 
 
 def init():
-    matplotlib.set_loglevel("info")
-    mpl_style(dark=True)
-
-
-def set_axis_style(ax):
-    ax.tick_params(axis="x", labelsize=12, which="major")
-    ax.xaxis.set_major_locator(mdates.DayLocator())
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%d/%m"))
-    ax.xaxis.set_minor_locator(mdates.HourLocator(byhour=range(3, 24, 3)))
-    ax.xaxis.set_minor_formatter(mdates.DateFormatter("%H:%M"))
-    ax.grid(True, which="both")
+    render.init(initializer=f"{_FIGURES}:init_worker")
 
 
 def _pressure_at_altitude(pressure: float) -> float:
     return pressure * pow(1.0 - config.general.altitude / 44330.0, 5.255)
 
 
-async def plot_linky(days: int = 2) -> bytes:
-    fig = Figure(figsize=(10, 4), constrained_layout=True)
-    ax = fig.add_subplot()
-
-    dts = []
-    values = []
+def _bucket_seconds(days: int, figsize: tuple[int, int]) -> Optional[int]:
+    """Get the bucket duration giving one bucket per pixel, or None if the
+    window is short enough to plot the raw records"""
+    if days <= config.graph.aggregate_after_days:
+        return None
+    return ceil(days * 86400 / (figsize[0] * DPI))
 
-    start_datetime = datetime.now(pytz.utc) - timedelta(days=days)
-    records = await get_all_linky_records(start_datetime, datetime.now(pytz.utc))
-    for r in records:
-        values.append(r[1])  # sinst
-        dts.append(datetime.fromtimestamp(r[2]))  # timestamp
 
-    ax.set_title("Linky")
-    ax.set_ylabel("VA")
-    set_axis_style(ax)
-    ax.plot(dts, values, color="yellow")
+async def _render(figure: str, func: str, *args) -> bytes:
+    """Render a figure in the render pool and record its metrics"""
+    start = time.perf_counter()
+    png = await render.run(func, *args)
+    metrics.render_duration.observe(time.perf_counter() - start, figure)
+    metrics.render_size.observe(len(png), figure)
+    return png
 
-    fig.autofmt_xdate(rotation=30, ha="right", which="both")
 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    return buf.getvalue()
+async def plot_linky(days: int = 2) -> bytes:
+    envelope = None
+
+    end_datetime = datetime.now(pytz.utc)
+    start_datetime = end_datetime - timedelta(days=days)
+    bucket = _bucket_seconds(days, LINKY_FIGSIZE)
+    if bucket is None:
+        timestamps, values = await get_linky_series(start_datetime, end_datetime)
+    else:
+        timestamps, *envelope, values = await get_linky_buckets(
+            start_datetime, end_datetime, bucket
+        )
+
+    return await _render(
+        "linky", f"{_FIGURES}:render_linky", timestamps, values, envelope
+    )
 
 
 async def plot_pressure(pmin: float, pmax: float, days: int = 3) -> bytes:
-    fig = Figure(figsize=(10, 4), constrained_layout=True)
-    ax = fig.add_subplot()
-
-    dts = []
-    values = []
-
-    start_datetime = datetime.now(pytz.utc) - timedelta(days=days)
-    records = await get_all_pressure_records(start_datetime, datetime.now(pytz.utc))
-    for r in records:
-        values.append(r[0])  # pressure
-        dts.append(datetime.fromtimestamp(r[1]))  # timestamp
-
-    ax.set_title("Pressure")
-    ax.set_ylabel("hPa")
-    ax.set_ylim(
-        auto=False,
-        ymin=_pressure_at_altitude(pmin),
-        ymax=_pressure_at_altitude(pmax)
+    envelope = None
+
+    end_datetime = datetime.now(pytz.utc)
+    start_datetime = end_datetime - timedelta(days=days)
+    bucket = _bucket_seconds(days, PRESSURE_FIGSIZE)
+    if bucket is None:
+        timestamps, values = await get_pressure_series(start_datetime, end_datetime)
+    else:
+        timestamps, *envelope, values = await get_pressure_buckets(
+            start_datetime, end_datetime, bucket
+        )
+
+    return await _render(
+        "pressure", f"{_FIGURES}:render_pressure", timestamps, values,
+        _pressure_at_altitude(pmin), _pressure_at_altitude(pmax),
+        _pressure_at_altitude(1013.25), envelope
     )
-    set_axis_style(ax)
-    ax.axhline(y=_pressure_at_altitude(1013.25), color='w', linestyle=':')
-    ax.plot(dts, values, color="limegreen", linewidth=2)
-
-    fig.autofmt_xdate(rotation=60, ha="right", which="both")
-
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    return buf.getvalue()
 
 
 async def plot_temperature_humidity(
     device: str, hmin: float, hmax: float, tmin: float, tmax: float, days: int = 2
 ) -> bytes:
-    fig = Figure(figsize=(10, 8), constrained_layout=True)
-    ax1, ax2 = fig.subplots(2, 1)
-
-    dts = []
-    hmds = []
-    tmps = []
-    start_datetime = datetime.now(pytz.utc) - timedelta(days=days)
-    records = await get_all_temperature_humidity_records(
-        device, start_datetime, datetime.now(pytz.utc)
+    h_envelope = None
+    t_envelope = None
+
+    end_datetime = datetime.now(pytz.utc)
+    start_datetime = end_datetime - timedelta(days=days)
+    bucket = _bucket_seconds(days, TEMPERATURE_HUMIDITY_FIGSIZE)
+    if bucket is None:
+        timestamps, hmds, tmps = await get_temperature_humidity_series(
+            device, start_datetime, end_datetime
+        )
+    else:
+        (
+            timestamps, hmd_min, hmd_max, hmds, tmp_min, tmp_max, tmps
+        ) = await get_temperature_humidity_buckets(
+            device, start_datetime, end_datetime, bucket
+        )
+        h_envelope = (hmd_min, hmd_max)
+        t_envelope = (tmp_min, tmp_max)
+
+    return await _render(
+        "temperature_humidity", f"{_FIGURES}:render_temperature_humidity",
+        timestamps, hmds, tmps, hmin, hmax, tmin, tmax, h_envelope, t_envelope
     )
-    for r in records:
-        hmds.append(r[0])  # humidity
-        tmps.append(r[1])  # temperature
-        dts.append(datetime.fromtimestamp(r[2]))  # timestamp
 
-    ax1.set_title("Humidity")
-    ax1.set_ylabel("%RH")
-    ax1.set_ylim( auto=False, ymin=hmin, ymax=hmax)
-    set_axis_style(ax1)
-    ax1.plot(dts, hmds, color="deepskyblue", linewidth=2)
 
-    ax2.set_title("Temperature")
-    ax2.set_ylabel("°C")
-    set_axis_style(ax2)
-    ax2.set_ylim(auto=False, ymin=tmin, ymax=tmax)
-    ax2.plot(dts, tmps, color="orange", linewidth=2)
+def linky_chart(days: Optional[int] = None) -> Chart:
+    kwargs = {} if days is None else {"days": days}
+    return Chart(
+        ("linky", days), get_last_linky_timestamp, partial(plot_linky, **kwargs)
+    )
+
+
+def pressure_chart(days: Optional[int] = None) -> Chart:
+    device = config.atmospheric_pressure
+    kwargs = {} if days is None else {"days": days}
+    return Chart(
+        ("pressure", days, device.min, device.max),
+        get_last_pressure_timestamp,
+        partial(plot_pressure, device.min, device.max, **kwargs)
+    )
+
+
+def temperature_humidity_chart(name: str, days: Optional[int] = None) -> Chart:
+    """Raises KeyError if the device is not in the configuration"""
+    device = config.humidity_temperatures[name]
+    kwargs = {} if days is None else {"days": days}
+    return Chart(
+        (
+            "temperature_humidity", name, days,
+            device.humidity_min, device.humidity_max,
+            device.temperature_min, device.temperature_max
+        ),
+        partial(get_last_temperature_humidity_timestamp, name),
+        partial(
+            plot_temperature_humidity, name,
+            device.humidity_min, device.humidity_max,
+            device.temperature_min, device.temperature_max,
+            **kwargs
+        )
+    )
 
-    fig.autofmt_xdate(rotation=30, ha="right", which="both")
 
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    return buf.getvalue()
+def get_dashboard_charts() -> list[Chart]:
+    """Get the charts of the dashboard, with their default window"""
+    return [
+        linky_chart(),
+        pressure_chart(),
+        *(temperature_humidity_chart(name) for name in config.humidity_temperatures),
+    ]
 
 
 async def close():
-    pass
+    await render.close()
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+
+import server.config as config
+from server.db import execute_batch
+from server.rollup import get_lower_watermark_statement
+
+_queue = None
+_task = None
+
+# put in the queue by close() to stop the writer
+_STOP = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_insert_queries = {
+    "linky": "INSERT INTO linky(east, sinst, timestamp) VALUES (?, ?, ?);",
+    "on_off": "INSERT INTO on_off(device, state, timestamp) VALUES (?, ?, ?);",
+    "pressure": "INSERT INTO pressure(pressure, timestamp) VALUES (?, ?);",
+    "temperature_humidity": (
+        "INSERT INTO temperature_humidity(device, humidity, temperature, timestamp) "
+        "VALUES (?, ?, ?, ?);"
+    ),
+}
+
+# fields of a reading and their accepted types, the timestamp excepted; bool
+# is a subclass of int, it is only accepted where it is listed
+_fields = {
+    "linky": (("east", (int,)), ("sinst", (int,))),
+    "on_off": (("device", (str,)), ("state", (bool, int))),
+    "pressure": (("pressure", (int, float)),),
+    "temperature_humidity": (
+        ("device", (str,)), ("humidity", (int, float)),
+        ("temperature", (int, float))
+    ),
+}
+
+
+async def init():
+    global _queue
+    global _task
+
+    _queue = asyncio.Queue(maxsize=config.ingest.max_pending)
+    _task = asyncio.create_task(_run())
+
+
+def parse_readings(table: str, data) -> list[tuple]:
+    """Convert one reading or a list of readings to rows of the table
+
+    Raises ValueError if a reading is malformed.
+    """
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list):
+        raise ValueError("a reading or a list of readings is expected")
+
+    now = int(time.time())
+    rows = []
+    for reading in data:
+        if not isinstance(reading, dict):
+            raise ValueError("a reading must be an object")
+        row = []
+        for name, types in _fields[table]:
+            try:
+                value = reading[name]
+            except KeyError:
+                raise ValueError(f"{name}: missing field")
+            if (
+                not isinstance(value, types)
+                or isinstance(value, bool) and bool not in types
+            ):
+                raise ValueError(f"{name}: bad value")
+            row.append(value)
+        timestamp = reading.get("timestamp", now)
+        if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+            raise ValueError("timestamp: bad value")
+        row.append(timestamp)
+        rows.append(tuple(row))
+    return rows
+
+
+async def put(table: str, rows: list[tuple]):
+    """Queue rows to be inserted in the table
+
+    Waits when too many rows are already pending.
+    """
+    for row in rows:
+        await _queue.put((table, row))
+
+
+async def _run():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        item = await _queue.get()
+        if item is _STOP:
+            break
+        batch = [item]
+        # the first reading of the batch is written at most max_delay seconds
+        # after its arrival
+        deadline = loop.time() + config.ingest.max_delay
+        while len(batch) < config.ingest.max_batch:
+            try:
+                item = _queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(_queue.get(), timeout)
+                except TimeoutError:
+                    break
+            if item is _STOP:
+                # the batch is written before stopping
+                stopping = True
+                break
+            batch.append(item)
+
+        await _flush(batch)
+
+
+async def _flush(batch: list[tuple[str, tuple]]):
+    rows = {}
+    for table, row in batch:
+        rows.setdefault(table, []).append(row)
+
+    statements = []
+    for table, table_rows in rows.items():
+        statements.append((_insert_queries[table], table_rows))
+        # the aggregates of the late readings are recomputed
+        statements.append(get_lower_watermark_statement(table, table_rows))
+    try:
+        await execute_batch(statements)
+        logger.debug(f"{len(batch)} readings written")
+    except Exception as exc:
+        logger.error(f"error while writing {len(batch)} readings ({exc})")
+
+
+async def close():
+    global _queue
+    global _task
+
+    # the writer is never cancelled: the readings it has taken from the queue
+    # would be lost, and the transaction left open
+    if _task is not None:
+        await _queue.put(_STOP)
+        await _task
+        _task = None
+
+    # write the readings queued after the stop
+    if _queue is not None:
+        batch = []
+        while not _queue.empty():
+            item = _queue.get_nowait()
+            if item is not _STOP:
+                batch.append(item)
+        if len(batch) != 0:
+            await _flush(batch)
+        _queue = None
@@ -1,19 +1,43 @@
 import argparse
 import asyncio
+import inspect
 import logging
 from logging import StreamHandler
+from os import getenv
 import signal
+import subprocess
 import sys
+import time
+from typing import Optional
 
 from aiohttp import web
 import aiohttp_jinja2
 import aiohttp_cors
 import jinja2
 
+from server.admission import close as admission_close
+from server.admission import init as admission_init
+from server.cache import close as cache_close
+from server.cache import init as cache_init
 import server.config as config
 from server.db import close as db_close
 from server.db import init as db_init
+from server.exportcache import close as exportcache_close
+from server.exportcache import init as exportcache_init
+from server.graph import close as graph_close
 from server.graph import init as graph_init
+from server.ingest import close as ingest_close
+from server.ingest import init as ingest_init
+from server.metrics import close as metrics_close
+from server.metrics import init as metrics_init
+from server.partition import close as partition_close
+from server.partition import init as partition_init
+from server.prerender import close as prerender_close
+from server.prerender import init as prerender_init
+from server.rollup import close as rollup_close
+from server.rollup import init as rollup_init
+from server.schema import close as schema_close
+from server.schema import init as schema_init
 from server.serverm import make_app
 from server.serverm import close as server_close
 from server.serverm import init as server_init
@@ -27,17 +51,55 @@ logger.addHandler(stream_handler)
 logger.setLevel(logging.DEBUG)
 
 
-async def init():
+_init_steps = (
+    ("metrics", metrics_init),
+    ("admission", admission_init),
+    ("graph", graph_init),
+    ("cache", cache_init),
+    ("exportcache", exportcache_init),
+    ("db", db_init),
+    ("schema", schema_init),
+    ("partition", partition_init),
+    # the readings lower the watermarks of the aggregates
+    ("rollup", rollup_init),
+    ("ingest", ingest_init),
+    ("prerender", prerender_init),
+    ("server", server_init),
+)
+
+
+async def init(timings: Optional[dict[str, float]] = None, serve: bool = True):
+    """Initialize the modules, storing the duration of each step in timings
+
+    The server step is skipped if serve is False, when the app is served by
+    gunicorn.
+    """
     set_loggers_level(config.loggers)
 
-    graph_init()
-    await db_init()
-    await server_init()
+    for name, step in _init_steps:
+        if name == "server" and not serve:
+            continue
+        start = time.perf_counter()
+        result = step()
+        if inspect.isawaitable(result):
+            await result
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
 
 
 async def close():
+    await prerender_close()
+    await rollup_close()
+    await ingest_close()
+    await partition_close()
+    await schema_close()
     await db_close()
+    await graph_close()
+    await cache_close()
+    await exportcache_close()
     await server_close()
+    await admission_close()
+    await metrics_close()
 
 
 async def run(config_filename: str):
@@ -49,12 +111,74 @@ async def run(config_filename: str):
         await asyncio.sleep(1)
 
 
+def _get_import_times() -> list[tuple[str, int]]:
+    """Get the name and cumulative import time (us) of each module imported
+    by server.main in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server.main"],
+        capture_output=True, text=True, check=True
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        times.append((fields[2].strip(), int(fields[1])))
+    return times
+
+
+async def profile_startup(config_filename: str, top: int = 15):
+    """Print the import time of the heaviest and of the server modules, then
+    the time of each initialization step
+
+    The server is not started, not to bind the address of a running one.
+    """
+    times = _get_import_times()
+    print("import time (ms, cumulative)")
+    total = next((us for name, us in times if name == "server.main"), 0)
+    print(f"  {total / 1000:9.1f}  server.main")
+    print("  heaviest packages:")
+    packages = [
+        (name, us) for name, us in times if "." not in name and name != "server"
+    ]
+    for name, us in sorted(packages, key=lambda entry: -entry[1])[:top]:
+        print(f"  {us / 1000:9.1f}  {name}")
+    print("  server modules:")
+    for name, us in times:
+        if name.startswith("server.") and name != "server.main":
+            print(f"  {us / 1000:9.1f}  {name}")
+
+    config.read(config_filename)
+    timings = {}
+    try:
+        await init(timings, serve=False)
+    finally:
+        await close()
+    print("init time (ms)")
+    for name, duration in timings.items():
+        print(f"  {duration * 1000:9.1f}  {name}")
+    print(f"  {sum(timings.values()) * 1000:9.1f}  total")
+
+
 def sigterm_handler(_signo, _stack_frame):
     # raises SystemExit(0):
     sys.exit(0)
 
 
+async def _on_startup(_app: web.Application):
+    # gunicorn imports app without calling main()
+    config.read(getenv("SERVER_CONFIG", "config.toml"))
+    await init(serve=False)
+
+
+async def _on_cleanup(_app: web.Application):
+    await close()
+
+
 app = make_app()
+app.on_startup.append(_on_startup)
+app.on_cleanup.append(_on_cleanup)
 
 
 def main():
@@ -62,8 +186,16 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", default="config.toml")
+    parser.add_argument(
+        "--profile-startup", action="store_true",
+        help="print the import and initialization times, then exit"
+    )
     args = parser.parse_args()
 
+    if args.profile_startup:
+        asyncio.run(profile_startup(args.config))
+        return
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
@@ -0,0 +1,180 @@
+import asyncio
+from bisect import bisect_left
+import logging
+from typing import Callable
+from typing import Optional
+
+_metrics = []
+_task = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# default buckets of the duration histograms, in seconds
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, value: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge set by the code, or computed by function at each scrape"""
+
+    def __init__(
+        self, name: str, description: str, labels: tuple[str, ...] = (),
+        function: Optional[Callable[[], float]] = None
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._function = function
+        self._values = {}
+        _metrics.append(self)
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def inc(self, *label_values, value: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + value
+
+    def dec(self, *label_values, value: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) - value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        if self._function is not None:
+            try:
+                self._values[()] = self._function()
+            except Exception as exc:
+                logger.error(f"error while computing {self.name} ({exc})")
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, description: str, labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # per label values: count per bucket (the last one being +Inf), sum
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        try:
+            counts, total = self._values[label_values]
+        except KeyError:
+            counts, total = [0] * (len(self.buckets) + 1), 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._values[label_values] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in self._values.items():
+            cumulated = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulated += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulated}"
+                )
+            labels = _labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulated}")
+        return lines
+
+
+def render() -> str:
+    """Get all the metrics in the Prometheus text format"""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests", ("route", "method", "status")
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request handling time", ("route", "method")
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests being handled"
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "database time per query", ("query",)
+)
+render_duration = Histogram(
+    "render_duration_seconds", "graph render time", ("figure",)
+)
+render_size = Histogram(
+    "render_png_bytes", "size of the rendered PNG", ("figure",),
+    buckets=(10000, 25000, 50000, 75000, 100000, 150000, 250000, 500000)
+)
+export_rows = Histogram(
+    "export_rows", "rows streamed per export", ("export", "format"),
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000)
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "delay of the event loop wake-ups"
+)
+
+
+async def _monitor_event_loop(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+
+def init():
+    global _task
+
+    _task = asyncio.get_running_loop().create_task(_monitor_event_loop())
+
+
+async def close():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime
+from datetime import timezone
+import logging
+from typing import Optional
+
+import server.config as config
+from server.db import get_month
+from server.db import get_month_span
+from server.db import get_rows
+from server.db import get_shard_path
+from server.db import move_to_shard
+from server.db import refresh_shards
+from server.db import TABLES
+from server.schema import create_shard
+
+_task = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_oldest_query = "SELECT MIN(timestamp) FROM {table};"
+
+
+async def init():
+    global _task
+
+    if config.database.partitioned:
+        _task = asyncio.create_task(_run())
+
+
+async def _run():
+    while True:
+        try:
+            await archive()
+        except Exception as exc:
+            logger.error(f"error while moving the old months ({exc})")
+        await asyncio.sleep(config.database.archive_interval)
+
+
+def _get_archive_limit() -> int:
+    """Get the first timestamp kept in the main database"""
+    now = datetime.now(timezone.utc)
+    months = now.year * 12 + now.month - 1 - config.database.hot_months
+    first = datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(first.timestamp())
+
+
+async def _get_oldest_timestamp() -> Optional[int]:
+    timestamps = []
+    for table in TABLES:
+        rows = await get_rows(_oldest_query.format(table=table))
+        if rows and rows[0][0] is not None:
+            timestamps.append(rows[0][0])
+    return min(timestamps, default=None)
+
+
+async def archive():
+    """Move the records older than the hot months to their monthly file"""
+    limit = _get_archive_limit()
+    while True:
+        oldest = await _get_oldest_timestamp()
+        if oldest is None or oldest >= limit:
+            break
+
+        month = get_month(oldest)
+        path = get_shard_path(month)
+        if not path.exists():
+            await create_shard(path)
+            # the readers must see the month before its records leave the
+            # main database
+            refresh_shards()
+        start, end = get_month_span(month)
+        await move_to_shard(month, start, end)
+        logger.info(f"records of {month} moved to {path}")
+
+
+async def close():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,101 @@
+import asyncio
+from functools import partial
+import logging
+import time
+
+import server.admission as admission
+import server.cache as cache
+import server.config as config
+from server.db import subscribe
+from server.db import unsubscribe
+from server.graph import get_dashboard_charts
+from server.typem import Chart
+from server.typem import OverloadedError
+
+_task = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+async def init():
+    global _task
+
+    if config.prerender.enabled:
+        _task = asyncio.create_task(_run())
+
+
+async def _refresh(chart: Chart) -> bool:
+    """Render the chart if its cached image is missing or stale"""
+    watermark = await chart.watermark()
+    if await cache.get(chart.key, watermark) is not None:
+        return False
+    # a request arriving meanwhile shares this rendering, which takes a render
+    # slot like those of the requests
+    await cache.get_or_produce(
+        chart.key, watermark, partial(admission.admitted, "render", chart.plot)
+    )
+    return True
+
+
+async def _refresh_all():
+    for chart in get_dashboard_charts():
+        try:
+            rendered = await _refresh(chart)
+        except OverloadedError:
+            # rendered at the next check
+            logger.debug(f"{chart.key} skipped, too many renders")
+            continue
+        except Exception as exc:
+            logger.error(f"error while rendering {chart.key} ({exc})")
+            continue
+        if rendered:
+            logger.debug(f"{chart.key} rendered")
+            # leave the render workers to the requests between two charts
+            await asyncio.sleep(config.prerender.stagger)
+
+
+async def _wait_for_data(queue: asyncio.Queue) -> bool:
+    """Wait for new records until the check interval elapses
+
+    Returns False if the subscription has ended.
+    """
+    try:
+        event = await asyncio.wait_for(queue.get(), config.prerender.interval)
+    except asyncio.TimeoutError:
+        return True
+    # the records arriving together are handled by a single check
+    while event is not None and not queue.empty():
+        event = queue.get_nowait()
+    return event is not None
+
+
+async def _run():
+    queue = subscribe()
+    try:
+        while True:
+            start = time.monotonic()
+            await _refresh_all()
+
+            # bound the renderings of a chart receiving data continuously
+            elapsed = time.monotonic() - start
+            await asyncio.sleep(max(0.0, config.prerender.min_interval - elapsed))
+            if not await _wait_for_data(queue):
+                # dropped while the records were piling up: check right away
+                unsubscribe(queue)
+                queue = subscribe()
+    finally:
+        unsubscribe(queue)
+
+
+async def close():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import importlib
+import logging
+import multiprocessing
+from typing import Callable
+from typing import Optional
+from typing import Union
+
+import server.config as config
+from server.typem import ServerError
+
+_executor = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _warm_up():
+    pass
+
+
+def _call(name: str, *args):
+    """Call the function named "module:function", importing its module"""
+    module_name, _, function_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)(*args)
+
+
+def init(initializer: Optional[str] = None):
+    """Start the render pool
+
+    initializer, named "module:function", is called by each worker.
+    """
+    global _executor
+
+    # forkserver avoids forking a process that already runs the aiosqlite
+    # threads
+    _executor = ProcessPoolExecutor(
+        max_workers=config.render.workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=None if initializer is None else _call,
+        initargs=() if initializer is None else (initializer,),
+    )
+
+    # workers are started on demand: submit one job per worker so that they
+    # are all started and initialized before the first request
+    for _ in range(config.render.workers):
+        _executor.submit(_warm_up)
+
+    logger.debug(f"render pool started with {config.render.workers} workers")
+
+
+async def run(func: Union[Callable, str], *args):
+    """Run func(*args) in a render worker and return its result
+
+    func may be named "module:function": the module is then only imported
+    by the workers.
+    """
+    if _executor is None:
+        raise ServerError("render pool not initialized")
+    if isinstance(func, str):
+        func, args = _call, (func, *args)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    except BrokenProcessPool as exc:
+        raise ServerError(f"render pool broken ({exc})") from exc
+
+
+async def close():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,306 @@
+import asyncio
+from datetime import datetime
+import logging
+from typing import Optional
+
+import server.config as config
+from server.db import execute_batch
+from server.db import execute_query
+from server.db import get_month
+from server.db import get_month_span
+from server.db import get_rows
+
+# the aggregates are stored in <table>_hourly and <table>_daily tables whose
+# buckets are aligned on UTC
+PERIODS = {"hourly": 3600, "daily": 86400}
+
+_task = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_watermark_table = (
+    "CREATE TABLE IF NOT EXISTS rollup_watermark ("
+    "name TEXT PRIMARY KEY, timestamp INTEGER NOT NULL"
+    ") WITHOUT ROWID;"
+)
+
+_tables = {
+    "linky": (
+        "CREATE TABLE IF NOT EXISTS linky_{period} ("
+        "bucket INTEGER PRIMARY KEY, count INTEGER, "
+        "sinst_min INTEGER, sinst_max INTEGER, sinst_avg REAL, "
+        "east_delta INTEGER"
+        ") WITHOUT ROWID;"
+    ),
+    "on_off": (
+        "CREATE TABLE IF NOT EXISTS on_off_{period} ("
+        "device TEXT, bucket INTEGER, count INTEGER, on_count INTEGER, "
+        "PRIMARY KEY (device, bucket)"
+        ") WITHOUT ROWID;"
+    ),
+    "pressure": (
+        "CREATE TABLE IF NOT EXISTS pressure_{period} ("
+        "bucket INTEGER PRIMARY KEY, count INTEGER, "
+        "pressure_min REAL, pressure_max REAL, pressure_avg REAL"
+        ") WITHOUT ROWID;"
+    ),
+    "temperature_humidity": (
+        "CREATE TABLE IF NOT EXISTS temperature_humidity_{period} ("
+        "device TEXT, bucket INTEGER, count INTEGER, "
+        "humidity_min REAL, humidity_max REAL, humidity_avg REAL, "
+        "temperature_min REAL, temperature_max REAL, temperature_avg REAL, "
+        "PRIMARY KEY (device, bucket)"
+        ") WITHOUT ROWID;"
+    ),
+}
+
+# aggregate the records between two timestamps by bucket, {seconds} being the
+# bucket duration; the buckets are aligned on UTC, so a bucket never spans two
+# months, hence two shards
+_bucket_queries = {
+    # the bounds of east give the consumption of the bucket
+    "linky": (
+        "SELECT timestamp / {seconds} * {seconds} AS bucket, COUNT(*), "
+        "MIN(sinst), MAX(sinst), AVG(sinst), MIN(east), MAX(east) "
+        "FROM linky "
+        "WHERE timestamp >= ? AND timestamp <= ? "
+        "GROUP BY bucket ORDER BY bucket;"
+    ),
+    "on_off": (
+        "SELECT device, timestamp / {seconds} * {seconds} AS bucket, COUNT(*), "
+        "SUM(state != 0) "
+        "FROM on_off "
+        "WHERE timestamp >= ? AND timestamp <= ? "
+        "GROUP BY device, bucket;"
+    ),
+    "pressure": (
+        "SELECT timestamp / {seconds} * {seconds} AS bucket, COUNT(*), "
+        "MIN(pressure), MAX(pressure), AVG(pressure) "
+        "FROM pressure "
+        "WHERE timestamp >= ? AND timestamp <= ? "
+        "GROUP BY bucket;"
+    ),
+    "temperature_humidity": (
+        "SELECT device, timestamp / {seconds} * {seconds} AS bucket, COUNT(*), "
+        "MIN(humidity), MAX(humidity), AVG(humidity), "
+        "MIN(temperature), MAX(temperature), AVG(temperature) "
+        "FROM temperature_humidity "
+        "WHERE timestamp >= ? AND timestamp <= ? "
+        "GROUP BY device, bucket;"
+    ),
+}
+
+_columns = {
+    "linky": (
+        "bucket", "count", "sinst_min", "sinst_max", "sinst_avg", "east_delta"
+    ),
+    "on_off": ("device", "bucket", "count", "on_count"),
+    "pressure": (
+        "bucket", "count", "pressure_min", "pressure_max", "pressure_avg"
+    ),
+    "temperature_humidity": (
+        "device", "bucket", "count",
+        "humidity_min", "humidity_max", "humidity_avg",
+        "temperature_min", "temperature_max", "temperature_avg"
+    ),
+}
+
+_insert_queries = {
+    table: (
+        f"INSERT OR REPLACE INTO {table}_{{period}}({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))});"
+    )
+    for table, columns in _columns.items()
+}
+
+_first_timestamp_query = "SELECT MIN(timestamp) FROM {table};"
+
+_last_timestamp_query = "SELECT MAX(timestamp) FROM {table};"
+
+_previous_east_query = (
+    "SELECT timestamp, east FROM linky "
+    "WHERE timestamp < ? "
+    "ORDER BY timestamp DESC LIMIT 1;"
+)
+
+_get_watermark_query = "SELECT timestamp FROM rollup_watermark WHERE name=?;"
+
+_insert_watermark_query = (
+    "INSERT OR IGNORE INTO rollup_watermark(name, timestamp) VALUES (?, ?);"
+)
+
+# the watermark is only moved if it has not been lowered since it was read
+_set_watermark_query = (
+    "UPDATE rollup_watermark SET timestamp=? WHERE name=? AND timestamp=?;"
+)
+
+# run in the transaction inserting the readings, so that the buckets of the
+# late readings are recomputed
+_lower_watermark_query = (
+    "UPDATE rollup_watermark SET timestamp=MIN(timestamp, ?) WHERE name=?;"
+)
+
+_aggregates_query = (
+    "SELECT {columns} FROM {table}_{period} "
+    "WHERE bucket >= ? AND bucket <= ? "
+    "ORDER BY bucket;"
+)
+
+_device_aggregates_query = (
+    "SELECT {columns} FROM {table}_{period} "
+    "WHERE device=? AND bucket >= ? AND bucket <= ? "
+    "ORDER BY bucket;"
+)
+
+
+async def init():
+    global _task
+
+    await execute_query(_watermark_table)
+    for table, ddl in _tables.items():
+        for period in PERIODS:
+            await execute_query(ddl.format(period=period))
+
+    _task = asyncio.create_task(_run())
+
+
+async def _run():
+    while True:
+        try:
+            await refresh()
+        except Exception as exc:
+            logger.error(f"error while refreshing the aggregates ({exc})")
+        await asyncio.sleep(config.rollup.refresh_interval)
+
+
+async def _get_watermark(table: str) -> Optional[int]:
+    rows = await get_rows(_get_watermark_query, table)
+    return rows[0][0] if rows else None
+
+
+def get_lower_watermark_statement(table: str, rows: list[tuple]) -> tuple:
+    """Get the statement, for execute_batch, lowering the watermark of the
+    table to the oldest timestamp of rows, the last column of each row"""
+    oldest = min(row[-1] for row in rows)
+    return _lower_watermark_query, [(oldest, table)]
+
+
+def _month_spans(start: int, end: int) -> list[tuple[int, int]]:
+    """Split [start, end] in the part of each month (UTC)"""
+    spans = []
+    while start <= end:
+        next_month = get_month_span(get_month(start))[1]
+        spans.append((start, min(end, next_month - 1)))
+        start = next_month
+    return spans
+
+
+async def _get_first_timestamp(table: str, end: int) -> Optional[int]:
+    rows = await get_rows(
+        _first_timestamp_query.format(table=table), span=(0, end)
+    )
+    # a row by group of shards in partitioned mode
+    return min((row[0] for row in rows or () if row[0] is not None), default=None)
+
+
+async def _add_east_deltas(rows: list[tuple], start: int) -> list[tuple]:
+    """Replace the east bounds of the linky buckets by their consumption,
+    counted from the last reading before each bucket"""
+    previous = await get_rows(_previous_east_query, start, span=(0, start - 1))
+    # a row by group of shards in partitioned mode
+    previous = max(previous or (), default=None)
+    east = None if previous is None else previous[1]
+
+    buckets = []
+    for *values, east_min, east_max in rows:
+        buckets.append((*values, east_max - (east_min if east is None else east)))
+        east = east_max
+    return buckets
+
+
+async def _get_buckets(
+    table: str, seconds: int, start: int, end: int
+) -> list[tuple]:
+    """Aggregate the records of a table between two timestamps
+
+    The months are aggregated in turn: in partitioned mode, each one is read
+    from its shard and from the main database, which holds the late readings
+    not yet archived.
+    """
+    query = _bucket_queries[table].format(seconds=seconds)
+    rows = []
+    for span in _month_spans(start, end):
+        rows += [tuple(row) for row in await get_rows(query, *span, span=span) or ()]
+    if table == "linky":
+        rows = await _add_east_deltas(rows, start)
+    return rows
+
+
+async def refresh():
+    """Recompute the buckets touched since the last watermark of each table"""
+    for table in _bucket_queries:
+        rows = await get_rows(_last_timestamp_query.format(table=table))
+        last_timestamp = rows[0][0] if rows else None
+        if last_timestamp is None:
+            continue
+
+        watermark = await _get_watermark(table)
+        if watermark == last_timestamp:
+            continue
+        if watermark is None:
+            first_timestamp = await _get_first_timestamp(table, last_timestamp)
+        else:
+            first_timestamp = watermark
+
+        statements = []
+        for period, seconds in PERIODS.items():
+            # the bucket holding the watermark may have been partially
+            # aggregated
+            start = first_timestamp // seconds * seconds
+            buckets = await _get_buckets(table, seconds, start, last_timestamp)
+            statements.append((_insert_queries[table].format(period=period), buckets))
+        if watermark is None:
+            statements.append((_insert_watermark_query, [(table, last_timestamp)]))
+        else:
+            statements.append(
+                (_set_watermark_query, [(last_timestamp, table, watermark)])
+            )
+        await execute_batch(statements)
+
+        logger.debug(f"{table} aggregated up to {last_timestamp}")
+
+
+async def get_aggregates(
+    table: str, period: str, start_date: datetime, end_date: datetime,
+    device: Optional[str] = None
+) -> list[dict]:
+    """Get the aggregates of a table for the buckets between two dates"""
+    columns = _columns[table]
+    args = [int(start_date.timestamp()), int(end_date.timestamp())]
+    if device is None:
+        query = _aggregates_query
+    else:
+        query = _device_aggregates_query
+        args.insert(0, device)
+
+    rows = await get_rows(
+        query.format(columns=", ".join(columns), table=table, period=period),
+        *args
+    )
+    if rows is None:
+        return []
+    return [dict(zip(columns, row)) for row in rows]
+
+
+async def close():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
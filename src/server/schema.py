@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from pathlib import Path
+import re
+
+import aiosqlite
+
+import server.config as config
+import server.db as db
+from server.db import execute_query
+from server.db import execute_transaction
+from server.db import get_query_plan
+from server.db import get_rows
+
+_task = None
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# the migration of index i brings the database to version i + 1, the version
+# being stored in PRAGMA user_version
+_migrations = [
+    # the tables, as created by the sensor daemons
+    [
+        "CREATE TABLE IF NOT EXISTS linky ("
+        "east INTEGER, sinst INTEGER, "
+        "timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"
+        ");",
+        "CREATE TABLE IF NOT EXISTS on_off ("
+        "device TEXT, state INTEGER, "
+        "timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"
+        ");",
+        "CREATE TABLE IF NOT EXISTS pressure ("
+        "pressure REAL, "
+        "timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"
+        ");",
+        "CREATE TABLE IF NOT EXISTS temperature_humidity ("
+        "device TEXT, humidity REAL, temperature REAL, "
+        "timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"
+        ");",
+    ],
+    # covering indexes of the range queries
+    [
+        "CREATE INDEX IF NOT EXISTS linky_timestamp_idx "
+        "ON linky(timestamp, east, sinst);",
+        "CREATE INDEX IF NOT EXISTS on_off_device_timestamp_idx "
+        "ON on_off(device, timestamp, state);",
+        "CREATE INDEX IF NOT EXISTS on_off_timestamp_idx "
+        "ON on_off(timestamp);",
+        "CREATE INDEX IF NOT EXISTS pressure_timestamp_idx "
+        "ON pressure(timestamp, pressure);",
+        "CREATE INDEX IF NOT EXISTS temperature_humidity_device_timestamp_idx "
+        "ON temperature_humidity(device, timestamp, humidity, temperature);",
+        "CREATE INDEX IF NOT EXISTS temperature_humidity_timestamp_idx "
+        "ON temperature_humidity(timestamp);",
+        "ANALYZE;",
+    ],
+]
+
+_parameter = re.compile(r"\?")
+
+
+async def init():
+    global _task
+
+    await migrate()
+    await check_query_plans()
+
+    _task = asyncio.create_task(_run())
+
+
+async def migrate():
+    """Apply the migrations the database has not seen yet"""
+    rows = await get_rows("PRAGMA user_version;")
+    version = rows[0][0] if rows else 0
+
+    for number, statements in enumerate(_migrations[version:], start=version + 1):
+        await execute_transaction(statements + [f"PRAGMA user_version={number};"])
+        logger.info(f"database migrated to version {number}")
+
+
+async def create_shard(path: Path):
+    """Create a monthly file with the tables and indexes of the database"""
+    async with aiosqlite.connect(path, autocommit=True) as conn:
+        await conn.execute("PRAGMA journal_mode=WAL;")
+        for statements in _migrations:
+            for statement in statements:
+                await conn.execute(statement)
+        await conn.execute(f"PRAGMA user_version={len(_migrations)};")
+    logger.info(f"{path} created")
+
+
+async def check_query_plans():
+    """Log a warning for each query of server.db scanning a whole table"""
+    for name, query in vars(db).items():
+        if not (name.startswith("_") and name.endswith("_query")):
+            continue
+
+        # the queries having a variable number of parameters are checked with
+        # a single one
+        query = query.replace("{devices}", "?")
+        args = [None] * len(_parameter.findall(query))
+        rows = await get_query_plan(query, *args)
+        for row in rows or ():
+            detail = row[3]
+            # the row of a SELECT without FROM is not a table scan
+            if (
+                detail.startswith("SCAN ") and " USING " not in detail
+                and detail != "SCAN CONSTANT ROW"
+            ):
+                logger.warning(f"{name} does not use an index ({detail})")
+
+
+async def _run():
+    while True:
+        await asyncio.sleep(config.database.optimize_interval)
+        # let SQLite refresh the statistics of the tables needing it
+        await execute_query("PRAGMA optimize;")
+        logger.debug("database optimized")
+
+
+async def close():
+    global _task
+
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,86 @@
+from datetime import datetime
+from datetime import timedelta
+from math import ceil
+from typing import Optional
+
+import pytz
+
+import server.config as config
+from server.db import get_linky_buckets
+from server.db import get_linky_series
+from server.db import get_pressure_buckets
+from server.db import get_pressure_series
+from server.db import get_temperature_humidity_buckets
+from server.db import get_temperature_humidity_series
+import server.render as render
+
+# content type of each encoding of the series
+FORMATS = {"json": "application/json", "binary": "application/octet-stream"}
+
+# the decimation needs numpy: it is named so that only the render workers
+# import it
+_ENCODE = "server.decimate:encode"
+
+# candidate points read from the database per returned point, when the
+# window is long enough to be averaged in SQL
+_OVERSAMPLING = 4
+
+
+def _get_window(days: int) -> tuple[datetime, datetime]:
+    end_datetime = datetime.now(pytz.utc)
+    return end_datetime - timedelta(days=days), end_datetime
+
+
+def _bucket_seconds(days: int, points: int) -> Optional[int]:
+    """Get the bucket duration of the SQL averages, or None if the window is
+    short enough to read the raw records"""
+    if days <= config.graph.aggregate_after_days:
+        return None
+    return ceil(days * 86400 / (points * _OVERSAMPLING))
+
+
+async def linky_series(points: int, series_format: str, days: int = 2) -> bytes:
+    start_datetime, end_datetime = _get_window(days)
+    bucket = _bucket_seconds(days, points)
+    if bucket is None:
+        timestamps, sinst = await get_linky_series(start_datetime, end_datetime)
+    else:
+        timestamps, _, _, sinst = await get_linky_buckets(
+            start_datetime, end_datetime, bucket
+        )
+    return await render.run(
+        _ENCODE, timestamps, {"sinst": sinst}, points, series_format
+    )
+
+
+async def pressure_series(points: int, series_format: str, days: int = 3) -> bytes:
+    start_datetime, end_datetime = _get_window(days)
+    bucket = _bucket_seconds(days, points)
+    if bucket is None:
+        timestamps, pressure = await get_pressure_series(start_datetime, end_datetime)
+    else:
+        timestamps, _, _, pressure = await get_pressure_buckets(
+            start_datetime, end_datetime, bucket
+        )
+    return await render.run(
+        _ENCODE, timestamps, {"pressure": pressure}, points, series_format
+    )
+
+
+async def temperature_humidity_series(
+    device: str, points: int, series_format: str, days: int = 2
+) -> bytes:
+    start_datetime, end_datetime = _get_window(days)
+    bucket = _bucket_seconds(days, points)
+    if bucket is None:
+        timestamps, hmds, tmps = await get_temperature_humidity_series(
+            device, start_datetime, end_datetime
+        )
+    else:
+        timestamps, _, _, hmds, _, _, tmps = await get_temperature_humidity_buckets(
+            device, start_datetime, end_datetime, bucket
+        )
+    return await render.run(
+        _ENCODE, timestamps, {"humidity": hmds, "temperature": tmps},
+        points, series_format
+    )
@@ -1,11 +1,15 @@
 import asyncio
 import base64
 from dataclasses import asdict
+from datetime import date
 from datetime import datetime
 from datetime import timedelta
+from functools import partial
+import json
 import logging
 from pathlib import Path
 import time
+from typing import Optional
 
 from aiohttp import web
 # from aiohttp.web import HTTPOk
@@ -15,15 +19,38 @@ import aiohttp_jinja2
 import aiohttp_cors
 import jinja2
 
+import server.admission as admission
+import server.cache as cache
 import server.config as config
-from server.graph import plot_linky
-from server.graph import plot_pressure
-from server.graph import plot_temperature_humidity
+from server.graph import linky_chart
+from server.graph import pressure_chart
+from server.graph import temperature_humidity_chart
+from server.db import get_last_on_off_timestamp
+from server.db import get_last_linky_timestamp
+from server.db import get_last_pressure_timestamp
+from server.db import get_last_temperature_humidity_timestamp
 from server.db import get_linky_records
-from server.db import get_all_on_off_records
+from server.db import get_on_off_dates
 from server.db import get_on_off_records
 from server.db import get_pressure_records
 from server.db import get_temperature_humidity_records
+from server.db import subscribe
+from server.db import unsubscribe
+from server.export import FORMATS
+from server.export import stream_export
+import server.exportcache as exportcache
+import server.ingest as ingest
+import server.metrics as metrics
+from server.series import FORMATS as SERIES_FORMATS
+from server.series import linky_series
+from server.series import pressure_series
+from server.series import temperature_humidity_series
+import server.singleflight as singleflight
+from server.rollup import get_aggregates
+from server.rollup import PERIODS
+from server.typem import Chart
+from server.typem import ExportColumn
+from server.typem import OverloadedError
 from server.typem import ServerError
 
 # logger initial setup
@@ -32,21 +59,146 @@ logger.setLevel(logging.INFO)
 
 _tz = None
 
+# number of points of the series
+_DEFAULT_POINTS = 1000
+_MAX_POINTS = 10000
+
+# longest window of the graphs in days, about ten years
+_MAX_DAYS = 3650
+
+# exported columns, the index is the column position in the records
+_linky_columns = (
+    ExportColumn("timestamp", "int", 2),
+    ExportColumn("east", "int", 0),
+    ExportColumn("sinst", "int", 1),
+)
+_on_off_columns = (
+    ExportColumn("timestamp", "int", 2),
+    ExportColumn("device", "str", 0),
+    ExportColumn("state", "int", 1),
+)
+_pressure_columns = (
+    ExportColumn("timestamp", "int", 1),
+    ExportColumn("pressure", "float", 0),
+)
+
+
+def _get_route(request: web.Request) -> str:
+    # the route template keeps the number of label values bounded
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else "unmatched"
+
+
+_deadlines_exceeded = metrics.Counter(
+    "http_deadlines_exceeded_total", "requests cancelled at their deadline",
+    ("route",)
+)
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler) -> web.StreamResponse:
+    """Record the handling time and the status of each request"""
+    start = time.perf_counter()
+    status = 500
+    metrics.http_requests_in_flight.inc()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    except asyncio.CancelledError:
+        # the client closed the connection
+        status = 499
+        raise
+    finally:
+        metrics.http_requests_in_flight.dec()
+        route = _get_route(request)
+        metrics.http_request_duration.observe(
+            time.perf_counter() - start, route, request.method
+        )
+        metrics.http_requests.inc(route, request.method, str(status))
+
+
+@web.middleware
+async def deadline_middleware(request: web.Request, handler) -> web.StreamResponse:
+    """Cancel the handling of a request after the deadline of its route
+
+    The cancellation interrupts the database queries of the request.
+    """
+    if config.server is None:
+        # configuration not read
+        return await handler(request)
+    route = _get_route(request)
+    deadline = config.server.deadlines.get(route, config.server.deadline)
+    if deadline <= 0:
+        return await handler(request)
+
+    try:
+        async with asyncio.timeout(deadline):
+            return await handler(request)
+    except TimeoutError:
+        _deadlines_exceeded.inc(route)
+        logger.warning(f"{request.path_qs} cancelled after {deadline}s")
+        if "response" in request and request.transport is not None:
+            # the headers of a streamed response are already sent: the
+            # connection is closed so that the client sees the body cut
+            request.transport.close()
+        raise web.HTTPGatewayTimeout(reason="deadline exceeded")
+
+
+async def _on_response_prepare(request: web.Request, response: web.StreamResponse):
+    # tells deadline_middleware that the headers are sent
+    request["response"] = response
+
+
+@web.middleware
+async def admission_middleware(request: web.Request, handler) -> web.StreamResponse:
+    """Answer 503 to the requests whose work was refused"""
+    try:
+        return await handler(request)
+    except OverloadedError as exc:
+        raise web.HTTPServiceUnavailable(
+            reason=str(exc),
+            headers={"Retry-After": str(config.admission.retry_after)}
+        )
+
 
 def make_app():
     # run a server
-    app = web.Application()
+    app = web.Application(
+        middlewares=[metrics_middleware, deadline_middleware, admission_middleware]
+    )
+    app.on_response_prepare.append(_on_response_prepare)
 
     app.router.add_get("/", default_handle)
     app.router.add_get("/datetime", datetime_handle)
+    app.router.add_post("/linky", linky_post_handle)
+    app.router.add_get("/linky/aggregate", linky_aggregate_handle)
     app.router.add_get("/linky/csv", linky_csv_handle)
+    app.router.add_get("/linky/export", linky_export_handle)
     app.router.add_get("/linky/image", linky_image_handle)
+    app.router.add_get("/linky/series", linky_series_handle)
+    app.router.add_get("/live", live_handle)
+    app.router.add_get("/metrics", metrics_handle)
+    app.router.add_get("/onoff/aggregate", onoff_aggregate_handle)
+    app.router.add_post("/onoff", onoff_post_handle)
     app.router.add_get("/onoff/csv", onoff_csv_handle)
+    app.router.add_get("/onoff/export", onoff_export_handle)
     app.router.add_get("/onoff/json", onoff_json_handle)
+    app.router.add_get("/pressure/aggregate", pressure_aggregate_handle)
+    app.router.add_post("/pressure", pressure_post_handle)
     app.router.add_get("/pressure/csv", pressure_csv_handle)
+    app.router.add_get("/pressure/export", pressure_export_handle)
     app.router.add_get("/pressure/image", pressure_image_handle)
+    app.router.add_get("/pressure/series", pressure_series_handle)
+    app.router.add_post("/temperature_humidity", temperature_humidity_post_handle)
+    app.router.add_get("/temperature_humidity/aggregate", temperature_humidity_aggregate_handle)
     app.router.add_get("/temperature_humidity/csv", temperature_humidity_csv_handle)
+    app.router.add_get("/temperature_humidity/export", temperature_humidity_export_handle)
     app.router.add_get("/temperature_humidity/image/{name}", temperature_humidity_image_handle)
+    app.router.add_get("/temperature_humidity/series/{name}", temperature_humidity_series_handle)
 
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
@@ -56,9 +208,11 @@ def make_app():
         )
     })
 
-    # Configure CORS on all routes.
+    # Configure CORS on all routes but the ingestion ones: the readings are
+    # not posted by web pages
     for route in list(app.router.routes()):
-        cors.add(route)
+        if route.method != "POST":
+            cors.add(route)
 
     # configure jinja2
     path = Path(__file__).parents[0]
@@ -75,7 +229,9 @@ async def init():
     app = make_app()
     # app["config"] = config
 
-    runner = web.AppRunner(app)
+    # the handler of a request is cancelled when its client disconnects; the
+    # gunicorn worker does not set this
+    runner = web.AppRunner(app, handler_cancellation=True)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", config.server.port)
     await site.start()
@@ -120,170 +276,402 @@ def _get_common_parameters(request: web.Request) -> tuple[datetime, datetime]:
     return start_date, end_date
 
 
+def _get_format_parameter(request: web.Request) -> str:
+    export_format = request.rel_url.query.get("format", "csv")
+    if export_format not in FORMATS:
+        raise web.HTTPBadRequest(reason="format: bad parameter")
+    return export_format
+
+
+async def _export(
+    request: web.Request, name: str, export_format: str,
+    columns: tuple[ExportColumn, ...], records,
+    start_date: datetime, end_date: datetime
+) -> web.StreamResponse:
+    try:
+        if exportcache.is_cacheable(end_date):
+            # the slot is only taken to store a missing export
+            return await exportcache.cached_export(
+                request, name, export_format, columns, records,
+                start_date, end_date
+            )
+        async with admission.slot("export"):
+            return await stream_export(
+                request, name, export_format, columns, records
+            )
+    except ServerError as exc:
+        raise web.HTTPNotImplemented(reason=str(exc))
+
+
+def _get_period_parameter(request: web.Request) -> str:
+    period = request.rel_url.query.get("period", "hourly")
+    if period not in PERIODS:
+        raise web.HTTPBadRequest(reason="period: bad parameter")
+    return period
+
+
+def _get_days_parameter(request: web.Request) -> dict:
+    try:
+        days = int(request.rel_url.query["days"])
+    except KeyError:
+        return {}
+    except ValueError:
+        raise web.HTTPBadRequest(reason="days: bad parameter")
+    if not 1 <= days <= _MAX_DAYS:
+        raise web.HTTPBadRequest(reason="days: out of range")
+    return {"days": days}
+
+
+def _get_series_parameters(request: web.Request) -> tuple[int, str]:
+    try:
+        points = int(request.rel_url.query.get("points", _DEFAULT_POINTS))
+    except ValueError:
+        raise web.HTTPBadRequest(reason="points: bad parameter")
+    if not 2 <= points <= _MAX_POINTS:
+        raise web.HTTPBadRequest(reason="points: out of range")
+
+    series_format = request.rel_url.query.get("format", "json")
+    if series_format not in SERIES_FORMATS:
+        raise web.HTTPBadRequest(reason="format: bad parameter")
+    return points, series_format
+
+
+async def _cached_response(
+    request: web.Request, key: tuple, watermark: Optional[int], produce,
+    content_type: str, kind: str
+) -> web.Response:
+    # only the production takes a slot of kind, not the cache hits
+    entry = await cache.get_or_produce(key, watermark, partial(admission.admitted, kind, produce))
+
+    if any(etag.value in (entry.etag, "*") for etag in request.if_none_match or ()):
+        response = web.Response(status=304)
+    else:
+        response = web.Response(body=entry.body, content_type=content_type)
+    response.etag = entry.etag
+    # the browser must revalidate each time the dashboard polls
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+async def _get_aggregates(
+    table: str, period: str, start_date: datetime, end_date: datetime,
+    device: Optional[str] = None
+) -> list[dict]:
+    return await singleflight.do(
+        ("aggregate", table, period, start_date, end_date, device),
+        partial(
+            admission.admitted, "json",
+            partial(get_aggregates, table, period, start_date, end_date, device)
+        )
+    )
+
+
+async def _cached_image_response(request: web.Request, chart: Chart) -> web.Response:
+    return await _cached_response(
+        request, chart.key, await chart.watermark(), chart.plot, "image/png",
+        "render"
+    )
+
+
+async def _ingest_readings(request: web.Request, table: str) -> web.Response:
+    # unlike a form, a JSON body makes the browsers ask the server before a
+    # cross-origin post, which the CORS setup refuses
+    if request.content_type != "application/json":
+        raise web.HTTPUnsupportedMediaType(reason="application/json expected")
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason="body: bad JSON")
+    try:
+        rows = ingest.parse_readings(table, data)
+    except ValueError as exc:
+        raise web.HTTPBadRequest(reason=str(exc))
+
+    await ingest.put(table, rows)
+    return web.json_response({"accepted": len(rows)}, status=202)
+
+
 async def datetime_handle(request: web.Request) -> web.Response:
     data = {"value": datetime.now().strftime("%Y/%m/%d %H:%M:%S")}
     return web.json_response(data)
 
 
 async def linky_image_handle(request: web.Request) -> web.StreamResponse:
+    days = _get_days_parameter(request)
     try:
-        data = await plot_linky()
-        return web.Response(body=data, content_type="image/png")
+        return await _cached_image_response(request, linky_chart(**days))
     except ServerError as exc:
         return web.HTTPInternalServerError(reason=str(exc))
 
 
-async def linky_csv_handle(request: web.Request) -> web.StreamResponse:
-    start_date, end_date = _get_common_parameters(request)
+async def linky_series_handle(request: web.Request) -> web.Response:
+    days = _get_days_parameter(request)
+    points, series_format = _get_series_parameters(request)
+    try:
+        return await _cached_response(
+            request,
+            ("linky_series", days.get("days"), points, series_format),
+            await get_last_linky_timestamp(),
+            partial(linky_series, points, series_format, **days),
+            SERIES_FORMATS[series_format],
+            "render"
+        )
+    except ServerError as exc:
+        return web.HTTPInternalServerError(reason=str(exc))
+
+
+_LIVE_TABLES = ("linky", "on_off", "pressure", "temperature_humidity")
+
+
+def _get_tables_parameter(request: web.Request) -> set[str]:
+    try:
+        tables = set(request.rel_url.query["tables"].split(","))
+    except KeyError:
+        return set(_LIVE_TABLES)
+    if not tables.issubset(_LIVE_TABLES):
+        raise web.HTTPBadRequest(reason="tables: bad parameter")
+    return tables
+
+
+async def live_handle(request: web.Request) -> web.StreamResponse:
+    """Push the new records as Server-Sent Events, one event per table"""
+    tables = _get_tables_parameter(request)
 
-    filename = f"linky-{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
     response = web.StreamResponse(
-        status=200,
-        reason="OK",
+        status=200, reason="OK",
         headers={
-            "Content-Type": "text/csv",
-            "Content-Disposition": f"Attachment; filename={filename}"
-        },
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            # do not let a reverse proxy hold the events back
+            "X-Accel-Buffering": "no",
+        }
     )
     await response.prepare(request)
 
-    # send csv header
-    await response.write("timestamp, east, sinst\n".encode())
+    queue = subscribe()
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), config.live.keepalive)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            if event is None:
+                break
+            table, rows = event
+            if table in tables:
+                data = json.dumps(rows, separators=(",", ":"))
+                await response.write(f"event: {table}\ndata: {data}\n\n".encode())
+    except ConnectionResetError:
+        logger.debug("live subscriber disconnected")
+    finally:
+        unsubscribe(queue)
+
+    return response
 
-    async for lks in get_linky_records(start_date, end_date):
-        if len(lks) == 0:
-            break
 
-        csv = ""
-        for lk in lks:
-            csv += f"{lk['timestamp']}, {lk['east']}, {lk['sinst']}\n"
+async def metrics_handle(request: web.Request) -> web.Response:
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
 
-        await response.write(csv.encode())
 
-    await response.write_eof()
-    return response
+async def linky_post_handle(request: web.Request) -> web.Response:
+    return await _ingest_readings(request, "linky")
 
 
-async def onoff_csv_handle(request: web.Request) -> web.StreamResponse:
+async def linky_aggregate_handle(request: web.Request) -> web.Response:
     start_date, end_date = _get_common_parameters(request)
+    period = _get_period_parameter(request)
+    data = await _get_aggregates("linky", period, start_date, end_date)
+    return web.json_response(data)
 
-    filename = f"onoff-{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
-    response = web.StreamResponse(
-        status=200,
-        reason="OK",
-        headers={
-            "Content-Type": "text/csv",
-            "Content-Disposition": f"Attachment; filename={filename}"
-        },
+
+async def _linky_export(
+    request: web.Request, export_format: str
+) -> web.StreamResponse:
+    start_date, end_date = _get_common_parameters(request)
+    return await _export(
+        request, "linky", export_format, _linky_columns,
+        get_linky_records(
+            start_date, end_date, records_number=config.export.batch_size
+        ),
+        start_date, end_date
     )
-    await response.prepare(request)
 
-    # send csv header
-    await response.write("timestamp, device, state\n".encode())
 
-    async for oos in get_on_off_records(start_date, end_date):
-        if len(oos) == 0:
-            break
+async def linky_csv_handle(request: web.Request) -> web.StreamResponse:
+    return await _linky_export(request, "csv")
 
-        csv = ""
-        for oo in oos:
-            csv += f"{oo['timestamp']}, {oo['device']}, {oo['state']}\n"
 
-        await response.write(csv.encode())
+async def linky_export_handle(request: web.Request) -> web.StreamResponse:
+    return await _linky_export(request, _get_format_parameter(request))
 
-    await response.write_eof()
-    return response
 
+async def onoff_post_handle(request: web.Request) -> web.Response:
+    return await _ingest_readings(request, "on_off")
 
-async def onoff_json_handle(request: web.Request) -> web.Response:
-    start_datetime = datetime.now() - timedelta(weeks=4)
-    data = {}
-    for device in config.events:
-        name = device.name
-        if name not in data:
-            data[name] = []
-        data[name] += [
-            (datetime.fromtimestamp(evt[2]).strftime("%Y/%m/%d %H:%M"))
-            for evt in await get_all_on_off_records(
-                name, start_datetime, datetime.now()
-            )
-        ]
+
+async def onoff_aggregate_handle(request: web.Request) -> web.Response:
+    start_date, end_date = _get_common_parameters(request)
+    period = _get_period_parameter(request)
+    name = request.rel_url.query.get("name")
+    data = await _get_aggregates("on_off", period, start_date, end_date, name)
     return web.json_response(data)
 
 
-async def pressure_csv_handle(request: web.Request) -> web.StreamResponse:
+async def _onoff_export(
+    request: web.Request, export_format: str
+) -> web.StreamResponse:
     start_date, end_date = _get_common_parameters(request)
+    name = request.rel_url.query.get("name")
+    return await _export(
+        request, "onoff", export_format, _on_off_columns,
+        get_on_off_records(
+            name, start_date, end_date, records_number=config.export.batch_size
+        ),
+        start_date, end_date
+    )
 
-    filename = f"pressure-{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
-    response = web.StreamResponse(
-        status=200,
-        reason="OK",
-        headers={
-            "Content-Type": "text/csv",
-            "Content-Disposition": f"Attachment; filename={filename}"
-        },
+
+async def onoff_csv_handle(request: web.Request) -> web.StreamResponse:
+    return await _onoff_export(request, "csv")
+
+
+async def onoff_export_handle(request: web.Request) -> web.StreamResponse:
+    return await _onoff_export(request, _get_format_parameter(request))
+
+
+async def _onoff_json() -> bytes:
+    start_datetime = datetime.now() - timedelta(weeks=4)
+    data = {device.name: [] for device in config.events}
+    for device, date_str in await get_on_off_dates(
+        list(data), start_datetime, datetime.now()
+    ):
+        data[device].append(date_str)
+    return json.dumps(data).encode()
+
+
+async def onoff_json_handle(request: web.Request) -> web.Response:
+    # the day is part of the key so that the events leave the 4 weeks window
+    # even if no new event arrives
+    return await _cached_response(
+        request,
+        ("onoff_json", date.today()),
+        await get_last_on_off_timestamp(),
+        _onoff_json,
+        "application/json",
+        "json"
     )
-    await response.prepare(request)
 
-    # send csv header
-    await response.write("timestamp, pressure\n".encode())
 
-    async for prs in get_pressure_records(start_date, end_date):
-        if len(prs) == 0:
-            break
+async def pressure_post_handle(request: web.Request) -> web.Response:
+    return await _ingest_readings(request, "pressure")
 
-        csv = ""
-        for pr in prs:
-            csv += f"{pr['timestamp']}, {pr['pressure']}\n"
 
-        await response.write(csv.encode())
+async def pressure_aggregate_handle(request: web.Request) -> web.Response:
+    start_date, end_date = _get_common_parameters(request)
+    period = _get_period_parameter(request)
+    data = await _get_aggregates("pressure", period, start_date, end_date)
+    return web.json_response(data)
 
-    await response.write_eof()
-    return response
+
+async def _pressure_export(
+    request: web.Request, export_format: str
+) -> web.StreamResponse:
+    start_date, end_date = _get_common_parameters(request)
+    return await _export(
+        request, "pressure", export_format, _pressure_columns,
+        get_pressure_records(
+            start_date, end_date, records_number=config.export.batch_size
+        ),
+        start_date, end_date
+    )
+
+
+async def pressure_csv_handle(request: web.Request) -> web.StreamResponse:
+    return await _pressure_export(request, "csv")
+
+
+async def pressure_export_handle(request: web.Request) -> web.StreamResponse:
+    return await _pressure_export(request, _get_format_parameter(request))
 
 
 async def pressure_image_handle(request: web.Request) -> web.StreamResponse:
+    days = _get_days_parameter(request)
     try:
-        device = config.atmospheric_pressure
-        data = await plot_pressure(device.min, device.max)
-        return web.Response(body=data, content_type="image/png")
+        return await _cached_image_response(request, pressure_chart(**days))
     except ServerError as exc:
         return web.HTTPInternalServerError(reason=str(exc))
 
 
-async def temperature_humidity_csv_handle(request: web.Request) -> web.StreamResponse:
+async def pressure_series_handle(request: web.Request) -> web.Response:
+    days = _get_days_parameter(request)
+    points, series_format = _get_series_parameters(request)
+    try:
+        return await _cached_response(
+            request,
+            ("pressure_series", days.get("days"), points, series_format),
+            await get_last_pressure_timestamp(),
+            partial(pressure_series, points, series_format, **days),
+            SERIES_FORMATS[series_format],
+            "render"
+        )
+    except ServerError as exc:
+        return web.HTTPInternalServerError(reason=str(exc))
+
+
+async def temperature_humidity_post_handle(request: web.Request) -> web.Response:
+    return await _ingest_readings(request, "temperature_humidity")
+
+
+async def temperature_humidity_aggregate_handle(request: web.Request) -> web.Response:
     start_date, end_date = _get_common_parameters(request)
+    period = _get_period_parameter(request)
     try:
         name = request.rel_url.query["name"]
     except KeyError:
         raise web.HTTPBadRequest(reason="device: missing parameter")
 
-    filename = f"temperature_humidity-{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
-    response = web.StreamResponse(
-        status=200,
-        reason="OK",
-        headers={
-            "Content-Type": "text/csv",
-            "Content-Disposition": f"Attachment; filename={filename}"
-        },
+    data = await _get_aggregates(
+        "temperature_humidity", period, start_date, end_date, name
     )
-    await response.prepare(request)
+    return web.json_response(data)
+
+
+async def _temperature_humidity_export(
+    request: web.Request, export_format: str
+) -> web.StreamResponse:
+    start_date, end_date = _get_common_parameters(request)
+    try:
+        name = request.rel_url.query["name"]
+    except KeyError:
+        raise web.HTTPBadRequest(reason="device: missing parameter")
 
-    # send csv header
-    await response.write("timestamp, name, humidity, temperature\n".encode())
+    columns = (
+        ExportColumn("timestamp", "int", 2),
+        ExportColumn("name", "str", value=name),
+        ExportColumn("humidity", "float", 0),
+        ExportColumn("temperature", "float", 1),
+    )
+    return await _export(
+        request, "temperature_humidity", export_format, columns,
+        get_temperature_humidity_records(
+            name, start_date, end_date, records_number=config.export.batch_size
+        ),
+        start_date, end_date
+    )
 
-    async for sss in get_temperature_humidity_records(name, start_date, end_date):
-        if len(sss) == 0:
-            break
 
-        csv = ""
-        for ss in sss:
-            csv += f"{ss['timestamp']}, {ss['humidity']}, {ss['temperature']}\n"
+async def temperature_humidity_csv_handle(request: web.Request) -> web.StreamResponse:
+    return await _temperature_humidity_export(request, "csv")
 
-        await response.write(csv.encode())
 
-    await response.write_eof()
-    return response
+async def temperature_humidity_export_handle(request: web.Request) -> web.StreamResponse:
+    return await _temperature_humidity_export(
+        request, _get_format_parameter(request)
+    )
 
 
 async def temperature_humidity_image_handle(request: web.Request) -> web.StreamResponse:
@@ -294,17 +682,39 @@ async def temperature_humidity_image_handle(request: web.Request) -> web.StreamR
     except ServerError as exc:
         return web.HTTPInternalServerError(reason=str(exc))
 
+    if name not in config.humidity_temperatures:
+        raise web.HTTPBadRequest(reason="device: not found in configuration")
+
+    days = _get_days_parameter(request)
     try:
-        device = config.humidity_temperatures[name]
-    except KeyError:
+        return await _cached_image_response(
+            request, temperature_humidity_chart(name, **days)
+        )
+    except ServerError as exc:
+        return web.HTTPInternalServerError(reason=str(exc))
+
+
+async def temperature_humidity_series_handle(request: web.Request) -> web.Response:
+    name = request.match_info["name"]
+    if name not in config.humidity_temperatures:
         raise web.HTTPBadRequest(reason="device: not found in configuration")
 
-    data = await plot_temperature_humidity(
-        name,
-        device.humidity_min, device.humidity_max,
-        device.temperature_min, device.temperature_max
-    )
-    return web.Response(body=data, content_type="image/png")
+    days = _get_days_parameter(request)
+    points, series_format = _get_series_parameters(request)
+    try:
+        return await _cached_response(
+            request,
+            (
+                "temperature_humidity_series", name, days.get("days"),
+                points, series_format
+            ),
+            await get_last_temperature_humidity_timestamp(name),
+            partial(temperature_humidity_series, name, points, series_format, **days),
+            SERIES_FORMATS[series_format],
+            "render"
+        )
+    except ServerError as exc:
+        return web.HTTPInternalServerError(reason=str(exc))
 
 
 async def run(config_filename: str):
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+
+import server.metrics as metrics
+
+# logger initial setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+_calls: dict[Hashable, _Call] = {}
+
+_joined = metrics.Counter(
+    "singleflight_joined_total", "calls which shared a call in flight"
+)
+
+
+def _forget(key: Hashable, call: _Call):
+    if _calls.get(key) is call:
+        del _calls[key]
+
+
+async def do(key: Hashable, func: Callable[[], Awaitable]) -> Any:
+    """Await func() once for all the concurrent callers with the same key
+
+    The callers arriving while the call is in flight share its result or its
+    exception. A cancelled caller (its client went away) only cancels the
+    call if no other caller awaits it.
+    """
+    call = _calls.get(key)
+    if call is None:
+        call = _Call(asyncio.ensure_future(func()))
+        _calls[key] = call
+        call.task.add_done_callback(lambda _: _forget(key, call))
+    else:
+        _joined.inc()
+        logger.debug(f"{key} joins the call in flight")
+
+    call.waiters += 1
+    try:
+        # the shield keeps the cancellation of a caller from reaching the
+        # shared call
+        return await asyncio.shield(call.task)
+    except asyncio.CancelledError:
+        if call.waiters == 1 and not call.task.done():
+            call.task.cancel()
+            _forget(key, call)
+        raise
+    finally:
+        call.waiters -= 1
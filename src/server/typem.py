@@ -1,6 +1,11 @@
 from dataclasses import dataclass
+from dataclasses import field
 from enum import auto
 from enum import Enum
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Optional
 
 
 class TriggerType(Enum):
@@ -9,15 +14,77 @@ class TriggerType(Enum):
     falling = auto()
 
 
+@dataclass
+class AdmissionConfig:
+    # jobs running at once and jobs waiting for each kind of work, the
+    # requests beyond are answered with a 503
+    render_concurrency: int = 2
+    render_queue: int = 16
+    export_concurrency: int = 2
+    export_queue: int = 4
+    json_concurrency: int = 8
+    json_queue: int = 64
+    # seconds the refused clients are asked to wait (Retry-After)
+    retry_after: int = 10
+
+
 @dataclass
 class AtmosphericPressureConfig:
     min: float
     max: float
 
 
+@dataclass
+class CacheConfig:
+    max_bytes: int = 16 * 1024 * 1024
+    # "memory" for a cache per process, "sqlite" for a file shared by the
+    # processes of the server
+    backend: str = "memory"
+    # file of the sqlite backend, "cache.db" next to the database if empty
+    path: str = ""
+
+
+@dataclass
+class CacheEntry:
+    watermark: Optional[int]
+    etag: str
+    body: bytes
+
+
+@dataclass
+class Chart:
+    # key of the rendered image in the cache
+    key: tuple
+    # get the newest timestamp of the plotted data
+    watermark: Callable[[], Awaitable[Optional[int]]]
+    # render the image
+    plot: Callable[[], Awaitable[bytes]]
+
+
 @dataclass
 class DatabaseConfig:
     path: str
+    # number of read-only connections
+    readers: int = 4
+    # a warning is logged when a reader is awaited longer (seconds)
+    wait_warning: float = 0.5
+    # page cache of each connection (KiB)
+    cache_size: int = 8192
+    # bytes of the database file mapped in memory
+    mmap_size: int = 268435456
+    # seconds between two PRAGMA optimize
+    optimize_interval: float = 86400.0
+    # move the old months to one file per month
+    partitioned: bool = False
+    # directory of the monthly files, "shards" next to the database if empty
+    shard_dir: str = ""
+    # complete months kept in the main database with the current one, the
+    # queries without time range (newest timestamps) only read these
+    hot_months: int = 1
+    # monthly files attached at once to a connection (SQLite allows 10)
+    max_attached: int = 8
+    # seconds between two moves of the old months
+    archive_interval: float = 3600.0
 
 
 @dataclass
@@ -26,11 +93,43 @@ class EventConfig:
     trigger: TriggerType
 
 
+@dataclass
+class ExportColumn:
+    name: str
+    # "int", "float" or "str"
+    type: str
+    # index of the column in the records, None for a constant column
+    index: Optional[int] = None
+    value: Any = None
+
+
+@dataclass
+class ExportConfig:
+    # records fetched from the database at once
+    batch_size: int = 1000
+    # bytes accumulated before writing to the client
+    chunk_size: int = 65536
+    # gzip/deflate compression level
+    compression_level: int = 6
+    # the exports ending more than late_arrival seconds ago are complete: they
+    # are kept gzipped on disk, up to cache_max_bytes (0 to disable)
+    late_arrival: float = 86400.0
+    cache_max_bytes: int = 256 * 1024 * 1024
+    # directory of the kept exports, "exports" next to the database if empty
+    cache_dir: str = ""
+
+
 @dataclass
 class GeneralConfig:
     altitude: float
 
 
+@dataclass
+class GraphConfig:
+    # longer windows are aggregated in SQL, one bucket per pixel
+    aggregate_after_days: float = 7.0
+
+
 @dataclass
 class HumidityTemperatureConfig:
     humidity_min: float
@@ -39,11 +138,81 @@ class HumidityTemperatureConfig:
     temperature_max: float
 
 
+@dataclass
+class IngestConfig:
+    # readings written in a single transaction
+    max_batch: int = 500
+    # seconds a reading may wait before being written
+    max_delay: float = 1.0
+    # readings queued before the clients are made to wait
+    max_pending: int = 10000
+
+
+@dataclass
+class LiveConfig:
+    # seconds between two checks for new records
+    interval: float = 1.0
+    # records read from a table at once
+    batch_size: int = 1000
+    # events queued for a subscriber before it is dropped
+    max_pending: int = 100
+    # seconds between two keep-alive comments of the event streams
+    keepalive: float = 15.0
+
+
+@dataclass
+class PrerenderConfig:
+    # render the dashboard charts in the background
+    enabled: bool = True
+    # seconds between two checks of the charts without new data event
+    interval: float = 300.0
+    # seconds between two renderings of the same chart at most
+    min_interval: float = 30.0
+    # seconds between the renderings of two charts
+    stagger: float = 1.0
+
+
+@dataclass
+class RenderConfig:
+    workers: int = 2
+
+
+@dataclass
+class RollupConfig:
+    refresh_interval: float = 300.0
+
+
+def _default_deadlines() -> dict[str, float]:
+    return {
+        "/live": 0.0,
+        "/linky/csv": 300.0,
+        "/linky/export": 300.0,
+        "/onoff/csv": 300.0,
+        "/onoff/export": 300.0,
+        "/pressure/csv": 300.0,
+        "/pressure/export": 300.0,
+        "/temperature_humidity/csv": 300.0,
+        "/temperature_humidity/export": 300.0,
+    }
+
+
 @dataclass
 class ServerConfig:
     address: str
     port: int
+    # seconds to handle a request before it is cancelled, 0 for no deadline
+    deadline: float = 30.0
+    # deadline of some routes, by route path
+    deadlines: dict[str, float] = field(default_factory=_default_deadlines)
+
+    def __post_init__(self):
+        # the deadlines of the configuration file override the default ones
+        self.deadlines = _default_deadlines() | self.deadlines
 
 
 class ServerError(Exception):
     pass
+
+
+class OverloadedError(Exception):
+    pass
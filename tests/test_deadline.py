@@ -0,0 +1,57 @@
+import asyncio
+from pathlib import Path
+
+import aiohttp
+from aiohttp.test_utils import TestClient
+from aiohttp.test_utils import TestServer
+import pytest
+
+import server.admission as admission
+import server.config as config
+import server.serverm as serverm
+from server.typem import ServerConfig
+
+CONFIG = Path(__file__).parents[1] / "config.toml"
+
+
+async def _slow_records(*args, **kwargs):
+    # east, sinst, timestamp, as the rows of the linky table
+    for i in range(100):
+        yield [(1000 + i, 100, 1747224137 + i)]
+        await asyncio.sleep(0.05)
+
+
+async def _download(path: str, deadline: float):
+    config.read(CONFIG)
+    config.server.deadlines[path] = deadline
+    admission.init()
+    try:
+        async with TestClient(TestServer(serverm.make_app())) as client:
+            async with client.get(
+                f"{path}?start=1747224137",
+                headers={"Accept-Encoding": "identity"},
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                status = response.status
+                await response.read()
+        return status
+    finally:
+        await admission.close()
+
+
+def test_streamed_export_past_deadline(monkeypatch):
+    monkeypatch.setattr(serverm, "get_linky_records", _slow_records)
+    # the headers are sent: the client must see the body cut, not hang
+    with pytest.raises(aiohttp.ClientPayloadError):
+        asyncio.run(_download("/linky/csv", 0.2))
+
+
+def test_export_within_deadline(monkeypatch):
+    monkeypatch.setattr(serverm, "get_linky_records", _slow_records)
+    assert asyncio.run(_download("/linky/csv", 30.0)) == 200
+
+
+def test_deadlines_added_to_defaults():
+    server = ServerConfig("127.0.0.1", 8080, deadlines={"/linky/csv": 5.0})
+    assert server.deadlines["/linky/csv"] == 5.0
+    assert server.deadlines["/live"] == 0.0
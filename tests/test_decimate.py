@@ -0,0 +1,38 @@
+from array import array
+
+import numpy as np
+import pytest
+
+from server.decimate import _decimate
+from server.decimate import lttb
+
+
+def _series(n: int) -> tuple[array, array, array]:
+    rng = np.random.default_rng(0)
+    timestamps = array("q", range(1747224137, 1747224137 + 60 * n, 60))
+    humidity = array("d", np.cumsum(rng.normal(size=n)) + 60.0)
+    temperature = array("d", np.cumsum(rng.normal(size=n)) + 20.0)
+    return timestamps, humidity, temperature
+
+
+@pytest.mark.parametrize("points", [2, 3, 1000])
+def test_points_kept(points):
+    timestamps, humidity, temperature = _series(5000)
+    t, values = _decimate(timestamps, [humidity, temperature], points)
+    assert len(t) == points
+    assert all(len(y) == points for y in values)
+    assert t[0] == timestamps[0] and t[-1] == timestamps[-1]
+
+
+def test_short_series_kept():
+    timestamps, humidity, _ = _series(10)
+    t, _ = _decimate(timestamps, [humidity], 1000)
+    assert len(t) == 10
+
+
+def test_nan_not_kept():
+    x = np.arange(100, dtype=np.float64)
+    y = np.arange(100, dtype=np.float64)
+    y[10:90:2] = np.nan
+    indices = lttb(x, y, 20)
+    assert not np.isnan(y[indices]).any()
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+import time
+
+import server.config as config
+import server.db as db
+import server.ingest as ingest
+import server.partition as partition
+import server.rollup as rollup
+import server.schema as schema
+
+CONFIG = Path(__file__).parents[1] / "config.toml"
+
+# a day of an archived month, and its aggregates
+DAY = datetime(2025, 1, 15, tzinfo=timezone.utc)
+DAY_END = datetime(2025, 1, 15, 23, 59, 59, tzinfo=timezone.utc)
+
+
+async def _setup(path: Path):
+    config.read(CONFIG)
+    config.database.path = str(path)
+    config.database.partitioned = True
+    config.database.hot_months = 0
+    await db.init()
+    await schema.migrate()
+    # creates the aggregate tables
+    await rollup.init()
+    await rollup.close()
+
+    day = int(DAY.timestamp())
+    now = int(time.time())
+    await db.execute_batch([
+        (
+            "INSERT INTO pressure(pressure, timestamp) VALUES (?, ?);",
+            [(1000.0 + hour, day + hour * 3600) for hour in range(24)]
+            + [(1013.0, now)]
+        ),
+        (
+            "INSERT INTO linky(east, sinst, timestamp) VALUES (?, ?, ?);",
+            [(10000 + 7 * hour, 300, day + hour * 3600 + 1800) for hour in range(24)]
+            + [(20000, 300, now)]
+        ),
+    ])
+
+
+async def _ingest_into_archived_month(path: Path) -> dict:
+    await _setup(path)
+    try:
+        await partition.archive()
+        assert db._shard_months == ["202501"]
+        await rollup.refresh()
+        before = await rollup.get_aggregates("pressure", "daily", DAY, DAY_END)
+
+        await ingest.init()
+        await ingest.put("pressure", [(1050.0, int(DAY.timestamp()) + 1)])
+        await ingest.close()
+        await rollup.refresh()
+
+        return {
+            "before": before,
+            "after": await rollup.get_aggregates("pressure", "daily", DAY, DAY_END),
+            "linky": await rollup.get_aggregates("linky", "hourly", DAY, DAY_END),
+        }
+    finally:
+        await db.close()
+
+
+def test_ingest_into_archived_month(tmp_path):
+    result = asyncio.run(_ingest_into_archived_month(tmp_path / "domotik.db"))
+
+    assert [bucket["count"] for bucket in result["before"]] == [24]
+    # the late reading, still in the main database, is aggregated with the
+    # records of the shard
+    after, = result["after"]
+    assert after["count"] == 25
+    assert after["pressure_min"] == 1000.0
+    assert after["pressure_max"] == 1050.0
+
+    # the consumption between two buckets is counted
+    deltas = [bucket["east_delta"] for bucket in result["linky"]]
+    assert deltas == [0] + [7] * 23